@@ -0,0 +1,100 @@
+""" This module contains a bounding volume hierarchy over 3D boxes. """
+import numpy as np
+
+from models import clipping
+
+
+class BoundingVolumeHierarchy:
+    """
+        Binary tree of axis-aligned boxes, each node bounds the boxes of the
+        items below it. It answers which items may be seen through a region
+        of the window without testing every item.
+
+        The tree is kept in flat arrays: node i bounds the items
+        items[starts[i]:ends[i]] and its children are left[i] and right[i],
+        which are -1 for leaves.
+    """
+
+    LEAF_SIZE = 32
+
+    def __init__(self, minimum, maximum):
+        minimum = np.asarray(minimum, dtype=np.float64).reshape(-1, 3)
+        maximum = np.asarray(maximum, dtype=np.float64).reshape(-1, 3)
+        self.items = np.arange(len(minimum))
+        nodes = []
+        if len(minimum):
+            self._build(nodes, minimum, maximum, (minimum + maximum) / 2,
+                        0, len(minimum))
+        nodes = np.array(nodes, dtype=np.float64).reshape(-1, 10)
+        self.minimum, self.maximum = nodes[:, 0:3], nodes[:, 3:6]
+        self.left, self.right, self.starts, self.ends = \
+            nodes[:, 6:].astype(np.int64).T
+
+        # the eight corners of every node, in homogeneous coordinates
+        bounds = (self.minimum, self.maximum)
+        self._corners = np.stack([
+            np.column_stack((
+                bounds[x][:, 0], bounds[y][:, 1], bounds[z][:, 2],
+                np.ones(len(nodes))))
+            for x in (0, 1) for y in (0, 1) for z in (0, 1)], axis=1)
+
+    def __len__(self):
+        return len(self.items)
+
+    def _build(self, nodes, minimum, maximum, centers, start, end):
+        """ Builds the subtree over items[start:end], returns its node. """
+        items = self.items[start:end]
+        node = len(nodes)
+        nodes.append([
+            *minimum[items].min(axis=0), *maximum[items].max(axis=0),
+            -1, -1, start, end])
+        if end - start > BoundingVolumeHierarchy.LEAF_SIZE:
+            # split the items in half, along the longest side of the node
+            axis = np.argmax(np.ptp(centers[items], axis=0))
+            items[:] = items[np.argsort(centers[items, axis], kind="stable")]
+            middle = (start + end) // 2
+            nodes[node][6] = self._build(
+                nodes, minimum, maximum, centers, start, middle)
+            nodes[node][7] = self._build(
+                nodes, minimum, maximum, centers, middle, end)
+        return node
+
+    def query(self, matrix, xmin, ymin, xmax, ymax):
+        """
+            Returns the items whose boxes may be visible in the given region
+            after being projected by a view projection matrix. Subtrees that
+            are completely outside the region are skipped and the ones
+            completely inside are taken without testing their children.
+        """
+        ranges = []
+        frontier = np.zeros(min(len(self.starts), 1), dtype=np.int64)
+        while len(frontier):
+            minimum, maximum, known = self._project(frontier, matrix)
+            outside = known & clipping.box_outside(
+                minimum, maximum, xmin, ymin, xmax, ymax)
+            inside = known & clipping.box_inside(
+                minimum, maximum, xmin, ymin, xmax, ymax)
+            leaf = self.left[frontier] < 0
+            ranges.append(frontier[inside | (leaf & ~outside)])
+            frontier = frontier[~inside & ~outside & ~leaf]
+            frontier = np.concatenate(
+                (self.left[frontier], self.right[frontier]))
+
+        nodes = np.concatenate(ranges) if ranges else np.zeros(0, np.int64)
+        starts, ends = self.starts[nodes], self.ends[nodes]
+        lengths = ends - starts
+        ramp = np.arange(lengths.sum()) - \
+            np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return self.items[np.repeat(starts, lengths) + ramp]
+
+    def _project(self, nodes, matrix):
+        """
+            Projects the boxes of the nodes and returns their 2D bounds,
+            along with a mask of the ones that are completely in front of
+            the center of projection, the others bounds are unknown.
+        """
+        corners = np.dot(self._corners[nodes], matrix)
+        known = np.all(corners[:, :, 3] > 0, axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            corners = corners[:, :, :2] / corners[:, :, 3:]
+        return corners.min(axis=1), corners.max(axis=1), known
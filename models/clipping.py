@@ -0,0 +1,251 @@
+""" This module contains the clipping algorithms used by the renderer. """
+import numpy as np
+
+
+def clip_lines(starts, ends, xmin, ymin, xmax, ymax):
+    """
+        Liang-Barsky line clipping algorithm over all lines at once.
+
+        Receives the (n, 2) start and end points of the lines and returns the
+        clipped start and end points, a mask of the lines that are at least
+        partially visible and, for every line, the side of the window through
+        which it entered and the side through which it exited (-1 when the
+        line did not cross it). Sides are numbered left, bottom, right, top.
+    """
+    deltax, deltay = (ends - starts).T
+    deltas = np.column_stack((-deltax, -deltay, deltax, deltay))  # p
+    distances = np.column_stack((  # q
+        starts[:, 0] - xmin, starts[:, 1] - ymin,
+        xmax - starts[:, 0], ymax - starts[:, 1]))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratios = distances / deltas  # r
+
+    # how much of the line is inside the window
+    enter_ratios = np.where(deltas < 0, ratios, -np.inf)
+    exit_ratios = np.where(deltas > 0, ratios, np.inf)
+    entered = np.argmax(enter_ratios, axis=1)
+    exited = np.argmin(exit_ratios, axis=1)
+    pct1 = enter_ratios[np.arange(len(starts)), entered]
+    pct2 = exit_ratios[np.arange(len(starts)), exited]
+    entered[pct1 <= 0] = -1
+    exited[pct2 >= 1] = -1
+    pct1, pct2 = np.maximum(pct1, 0), np.minimum(pct2, 1)
+
+    visible = ~np.any((deltas == 0) & (distances < 0), axis=1) & \
+        (pct1 <= pct2)
+    clipped_deltas = np.column_stack((deltax, deltay))
+    return (
+        starts + pct1[:, np.newaxis] * clipped_deltas,
+        starts + pct2[:, np.newaxis] * clipped_deltas,
+        visible, entered, exited)
+
+
+def clip_faces(points, mesh, corners, faces=None):
+    """
+        Weiler-Atherton polygon clipping algorithm.
+
+        Clips every face of the mesh, taking its vertices from the (n, 2)
+        projected points, against the window with the given corners (top
+        left, bottom left, bottom right and top right). Returns the clipped
+        faces as polylines: an array of points and the offsets delimiting
+        each polyline. Faces not set in the optional 'faces' mask are known
+        to be outside the window and are skipped.
+    """
+    boundaries = (*corners[1], *corners[3])
+    edges, edge_offsets = mesh.edges, mesh.edge_offsets
+
+    # faces completely inside or outside the window are found by their
+    # bounding boxes, only the edges of the remaining ones are clipped
+    selected = np.diff(mesh.offsets) > 0
+    if faces is not None:
+        selected &= faces
+    face_inside, face_outside = np.zeros(len(mesh), dtype=bool), ~selected
+    if np.any(selected):
+        if faces is None:
+            face_points = points[mesh.indices]
+            first = mesh.offsets[:-1][selected]
+        else:
+            positions, first = _face_positions(mesh, np.flatnonzero(selected))
+            face_points = points[mesh.indices[positions]]
+        minimum = np.minimum.reduceat(face_points, first)
+        maximum = np.maximum.reduceat(face_points, first)
+        face_inside[selected] = box_inside(minimum, maximum, *boundaries)
+        face_outside[selected] = box_outside(minimum, maximum, *boundaries)
+
+    candidates = np.flatnonzero(np.repeat(
+        ~(face_inside | face_outside), np.diff(edge_offsets)))
+    starts, ends = np.empty((2, len(edges), 2))
+    visible = np.repeat(face_inside, np.diff(edge_offsets))
+    entered, exited = np.full((2, len(edges)), -1)
+    starts[candidates], ends[candidates], visible[candidates], \
+        entered[candidates], exited[candidates] = clip_lines(
+            points[edges[candidates, 0]], points[edges[candidates, 1]],
+            *boundaries)
+
+    # faces whose edges are all visible and never cross the window are
+    # kept as they are, the others need to be reconnected one by one
+    crossing = visible & ((entered >= 0) | (exited >= 0))
+    visible_edges = _count(visible, edge_offsets)
+    inside = (visible_edges == np.diff(edge_offsets)) & \
+        (_count(crossing, edge_offsets) == 0) & (np.diff(mesh.offsets) > 0)
+    partial = np.flatnonzero(~inside & (visible_edges > 0))
+
+    lengths = np.zeros(len(mesh), dtype=np.int64)
+    lengths[inside] = np.diff(mesh.offsets)[inside] + mesh.closed[inside]
+    reconnected = [
+        _reconnect(
+            starts, ends, visible, entered, exited,
+            range(edge_offsets[face], edge_offsets[face + 1]),
+            mesh.closed[face], corners)
+        for face in partial.tolist()]
+    lengths[partial] = list(map(len, reconnected))
+
+    offsets = np.zeros(len(mesh) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    clipped = np.empty((offsets[-1], 2))
+    destination, source = gather_faces(mesh, inside, offsets)
+    clipped[destination] = points[source]
+    for face, polyline in zip(partial.tolist(), reconnected):
+        clipped[offsets[face]:offsets[face + 1]] = polyline
+    return clipped, offsets[np.concatenate(([True], lengths > 0))]
+
+
+def clip_edges(points, edges, corners):
+    """
+        Clips independent edges, given as pairs of indices of the points,
+        against the window. Returns the visible part of every edge as a two
+        point polyline, in the same format as clip_faces.
+    """
+    return clip_segments(points[edges[:, 0]], points[edges[:, 1]], corners)
+
+
+def clip_segments(starts, ends, corners):
+    """
+        Clips segments given by their (n, 2) start and end points against
+        the window, returns the same as clip_edges.
+    """
+    starts, ends, visible, _, _ = clip_lines(
+        starts, ends, *corners[1], *corners[3])
+    return _segments(starts[visible], ends[visible])
+
+
+def edge_polylines(points, edges):
+    """ Lays out the edges as two point polylines, without clipping. """
+    return _segments(points[edges[:, 0]], points[edges[:, 1]])
+
+
+def polylines(points, mesh, faces=None):
+    """
+        Lays out all faces of the mesh, or the ones in the optional 'faces'
+        mask, as polylines, taking its vertices from the points. Returns the
+        same as clip_faces.
+    """
+    selected = np.ones(len(mesh), dtype=bool) if faces is None else faces
+    lengths = np.where(selected, np.diff(mesh.offsets) + mesh.closed, 0)
+    offsets = np.zeros(len(mesh) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    destination, source = gather_faces(mesh, selected, offsets)
+    output = np.empty((offsets[-1], points.shape[1]))
+    output[destination] = points[source]
+    if faces is not None:
+        offsets = offsets[np.concatenate(([True], faces))]
+    return output, offsets
+
+
+def box_inside(minimum, maximum, xmin, ymin, xmax, ymax):
+    """ Whether the boxes with the given 2D corners are inside the window. """
+    return (minimum[..., 0] >= xmin) & (minimum[..., 1] >= ymin) & \
+        (maximum[..., 0] <= xmax) & (maximum[..., 1] <= ymax)
+
+
+def box_outside(minimum, maximum, xmin, ymin, xmax, ymax):
+    """ Whether the boxes with the given 2D corners miss the window. """
+    return (maximum[..., 0] < xmin) | (maximum[..., 1] < ymin) | \
+        (minimum[..., 0] > xmax) | (minimum[..., 1] > ymax)
+
+
+def gather_faces(mesh, selected, offsets):
+    """
+        Returns where to write and which vertices to read to lay out the
+        selected faces of the mesh as polylines starting at the given
+        offsets. Closed faces repeat their first vertex at the end.
+    """
+    faces = np.flatnonzero(selected)
+    starts = mesh.offsets[faces]
+    lengths = mesh.offsets[faces + 1] - starts
+    source, first = _face_positions(mesh, faces)
+    destination = np.repeat(offsets[faces] - first, lengths) + \
+        np.arange(len(source))
+
+    closed = faces[mesh.closed[faces] & (lengths > 0)]
+    destination = np.concatenate((destination, offsets[closed + 1] - 1))
+    source = np.concatenate((source, mesh.offsets[closed]))
+    return destination, mesh.indices[source]
+
+
+def _segments(starts, ends):
+    """ Interleaves start and end points into two point polylines. """
+    return (
+        np.stack((starts, ends), axis=1).reshape(-1, starts.shape[1]),
+        np.arange(0, 2 * len(starts) + 1, 2))
+
+
+def _face_positions(mesh, faces):
+    """
+        Positions in mesh.indices of the vertices of the given faces, laid
+        one face after the other, and where each face starts among them.
+    """
+    starts = mesh.offsets[faces]
+    lengths = mesh.offsets[faces + 1] - starts
+    first = np.cumsum(lengths) - lengths
+    positions = np.repeat(starts - first, lengths) + np.arange(lengths.sum())
+    return positions, first
+
+
+def _count(mask, offsets):
+    """ Number of set entries of the mask between consecutive offsets. """
+    total = np.concatenate(([0], np.cumsum(mask)))
+    return total[offsets[1:]] - total[offsets[:-1]]
+
+
+def _reconnect(starts, ends, visible, entered, exited, edges, closed,
+               corners):
+    """
+        Walks the clipped edges of a face that crosses the window, connecting
+        the points where it exits and enters the window through its corners.
+    """
+
+    def connect_points(clipped, side1, side2):
+        """ Connects points of the window. """
+        edge = side1
+        while edge != side2:
+            clipped.append(corners[edge])
+            edge = (edge - 1) % 4
+
+    new_face = []
+    face_entered, face_exited = None, None
+    for edge in edges:
+        if not visible[edge]:  # clipped line is outside window
+            continue
+
+        if entered[edge] >= 0:
+            if face_exited is not None:
+                connect_points(new_face, face_exited, entered[edge])
+            else:
+                face_entered = entered[edge]
+
+        if exited[edge] >= 0:
+            face_exited = exited[edge]
+            new_face.append(starts[edge])
+            new_face.append(ends[edge])
+        else:
+            new_face.append(starts[edge])
+
+    if new_face and closed:
+        if face_entered is not None and face_exited is not None:
+            connect_points(new_face, face_exited, face_entered)
+        new_face.append(new_face[0])
+    elif new_face and visible[edges[-1]] and exited[edges[-1]] < 0:
+        new_face.append(ends[edges[-1]])  # last point of a polyline
+
+    return new_face
@@ -0,0 +1,195 @@
+"""
+    This module contains a hidden line removal algorithm that draws the faces
+    in a depth buffer and keeps the parts of the edges that are not behind
+    them.
+"""
+import numpy as np
+
+from models import clipping
+
+# edges are tested every STEP pixels, but no more than MAXIMUM_SAMPLES times
+STEP = 1
+MAXIMUM_SAMPLES = 512
+# how much nearer, relative to its depth, a face has to be to hide an edge
+BIAS = 5e-3
+# pixels rasterized at once, to bound the memory used
+BATCH_SIZE = 1 << 20
+
+
+def depth_buffer(layers, to_pixels, size):
+    """
+        Draws the faces of several meshes in a single depth buffer of the
+        viewport size, so each of them hides the edges of all others.
+        Layers are (mesh, points, depths, faces) tuples: points are the
+        projected vertices of the mesh and depths their inverse homogeneous
+        coordinate, which is larger for nearer vertices, faces a mask of
+        the faces to draw. to_pixels takes points to the viewport.
+    """
+    # starting with nothing, so that no layers draw an empty buffer
+    pixels, depths = [np.zeros((0, 2))], [np.zeros(0)]
+    triangles, count = [np.zeros((0, 3), dtype=np.int64)], 0
+    for mesh, points, layer_depths, faces in layers:
+        pixels.append(to_pixels(points))
+        depths.append(layer_depths)
+        triangles.append(_triangles(mesh, faces).astype(np.int64) + count)
+        count += len(points)
+    return _depth_buffer(
+        np.concatenate(pixels), np.concatenate(depths),
+        np.concatenate(triangles), size)
+
+
+def visible_segments(points, depths, mesh, faces, corners, to_pixels,
+                     buffer):
+    """
+        Returns the (n, 2) start and end points of the visible parts of the
+        edges of the faces in the mask, clipped against the window corners
+        and tested against a buffer built by depth_buffer. Points, depths
+        and to_pixels are the same given to depth_buffer.
+    """
+    size = buffer.shape[::-1]
+
+    # only the parts of the edges inside the window are sampled, depths
+    # change linearly along the projected edges
+    edges = mesh.unique_edges[mesh.unique_edges_of(faces)]
+    first, last = points[edges[:, 0]], points[edges[:, 1]]
+    starts, ends, inside, _, _ = clipping.clip_lines(
+        first, last, *corners[1], *corners[3])
+    edges, first, last = edges[inside], first[inside], last[inside]
+    starts, ends = starts[inside], ends[inside]
+    near, far = depths[edges[:, 0]], depths[edges[:, 1]]
+    start_depths = near + _ratios(starts, first, last) * (far - near)
+    end_depths = near + _ratios(ends, first, last) * (far - near)
+
+    # sample every edge along its length in the viewport
+    pixel_starts, pixel_ends = to_pixels(starts), to_pixels(ends)
+    lengths = np.linalg.norm(pixel_ends - pixel_starts, axis=1)
+    counts = np.clip(
+        np.ceil(lengths / STEP), 1, MAXIMUM_SAMPLES).astype(np.int64) + 1
+    offsets = np.cumsum(counts) - counts
+    edge = np.repeat(np.arange(len(edges)), counts)
+    ratios = (np.arange(counts.sum()) - offsets[edge]) / (counts[edge] - 1)
+    samples = pixel_starts[edge] + ratios[:, np.newaxis] * \
+        (pixel_ends[edge] - pixel_starts[edge])
+    sample_depths = start_depths[edge] + ratios * \
+        (end_depths[edge] - start_depths[edge])
+
+    # samples that round outside the viewport are left to the clipping
+    columns, rows = np.floor(samples).astype(np.int64).T
+    inside = (columns >= 0) & (columns < size[0]) & \
+        (rows >= 0) & (rows < size[1])
+    visible = ~inside
+    visible[inside] = sample_depths[inside] * (1 + BIAS) >= \
+        buffer[rows[inside], columns[inside]]
+
+    # consecutive visible samples of an edge become a single segment
+    final = np.zeros(len(visible), dtype=bool)
+    final[offsets + counts - 1] = True
+    joined = visible[:-1] & visible[1:] & ~final[:-1]
+    run_starts = np.flatnonzero(
+        joined & ~np.concatenate(([False], joined[:-1])))
+    run_ends = np.flatnonzero(
+        joined & ~np.concatenate((joined[1:], [False]))) + 1
+    segments = starts[edge] + ratios[:, np.newaxis] * \
+        (ends[edge] - starts[edge])
+    return segments[run_starts], segments[run_ends]
+
+
+def _ratios(points, starts, ends):
+    """
+        Where the points lie along the segments they belong to, from 0 at
+        their start to 1 at their end.
+    """
+    deltas = ends - starts
+    lengths = np.einsum("ij,ij->i", deltas, deltas)
+    lengths[lengths == 0] = 1  # a single point, its start will do
+    return np.einsum("ij,ij->i", points - starts, deltas) / lengths
+
+
+def _triangles(mesh, faces):
+    """
+        (n, 3) vertex indices of the triangles that cover the closed faces
+        in the mask, as fans around their first vertex.
+    """
+    lengths = np.diff(mesh.offsets)
+    faces = np.flatnonzero(faces & mesh.closed & (lengths >= 3))
+    counts = lengths[faces] - 2
+    face = np.repeat(faces, counts)
+    steps = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                counts)
+    starts = mesh.offsets[face]
+    return np.column_stack((
+        mesh.indices[starts], mesh.indices[starts + steps + 1],
+        mesh.indices[starts + steps + 2]))
+
+
+def _depth_buffer(pixels, depths, triangles, size):
+    """
+        Rasterizes the triangles, returns a (height, width) array with the
+        largest depth drawn in every pixel, -inf where nothing was drawn.
+    """
+    width, height = size
+    buffer = np.full(width * height, -np.inf)
+    corners = pixels[triangles]  # (n, 3, 2)
+    minimum = np.floor(corners.min(axis=1)).astype(np.int64)
+    maximum = np.floor(corners.max(axis=1)).astype(np.int64)
+    minimum = np.maximum(minimum, 0)
+    maximum = np.minimum(maximum, (width - 1, height - 1))
+    areas = _cross(corners[:, 0], corners[:, 1], corners[:, 2])
+    kept = np.flatnonzero(np.all(maximum >= minimum, axis=1) & (areas != 0))
+    minimum, maximum = minimum[kept], maximum[kept]
+    spans = maximum - minimum + 1
+    counts = spans[:, 0] * spans[:, 1]
+
+    # the barycentric coordinates, and so the depths, are planes over the
+    # viewport, evaluated as x * a + y * b + c
+    weights = _weight_planes(corners[kept], areas[kept])  # (n, 3, 3)
+    depth_planes = np.einsum(
+        "ijk,ij->ik", weights, depths[triangles[kept]])  # (n, 3)
+
+    # triangles are drawn in batches of about BATCH_SIZE pixels
+    bounds = np.searchsorted(
+        np.cumsum(counts), np.arange(BATCH_SIZE, counts.sum(), BATCH_SIZE))
+    for batch in np.split(np.arange(len(kept)), np.unique(bounds)):
+        if not len(batch):
+            continue
+        triangle = np.repeat(batch, counts[batch])
+        index = np.arange(counts[batch].sum()) - np.repeat(
+            np.cumsum(counts[batch]) - counts[batch], counts[batch])
+        row, column = np.divmod(index, spans[triangle, 0])
+        column += minimum[triangle, 0]
+        row += minimum[triangle, 1]
+
+        # only the pixels whose centers are inside their triangle are drawn
+        x, y = column + 0.5, row + 0.5
+        covered = np.ones(len(triangle), dtype=bool)
+        for corner in range(3):
+            a, b, c = weights[:, corner].T
+            covered &= a[triangle] * x + b[triangle] * y + c[triangle] >= 0
+        triangle, x, y = triangle[covered], x[covered], y[covered]
+        a, b, c = depth_planes.T
+        np.maximum.at(
+            buffer, (row * width + column)[covered],
+            a[triangle] * x + b[triangle] * y + c[triangle])
+    return buffer.reshape(height, width)
+
+
+def _weight_planes(corners, areas):
+    """
+        (n, 3, 3) coefficients of the planes that give the barycentric
+        coordinate of each corner of the (n, 3, 2) triangles.
+    """
+    # the coordinate of a corner is the signed area of the triangle made
+    # by the opposite side and the point, over the area of the triangle
+    starts = corners[:, [1, 2, 0]]
+    ends = corners[:, [2, 0, 1]]
+    deltas = ends - starts
+    return np.stack((
+        -deltas[..., 1], deltas[..., 0],
+        deltas[..., 1] * starts[..., 0] - deltas[..., 0] * starts[..., 1]),
+        axis=2) / areas[:, np.newaxis, np.newaxis]
+
+
+def _cross(a, b, c):
+    """ Twice the signed area of the triangles with corners a, b and c. """
+    return (b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - \
+        (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0])
@@ -0,0 +1,392 @@
+""" This module contains the indexed storage of wireframe geometry. """
+import numpy as np
+
+from models.bvh import BoundingVolumeHierarchy
+
+
+class Mesh:
+    """
+        Geometry of a wireframe stored as one contiguous vertex buffer and a
+        CSR-style face index: face i is the polygon (or polyline, if it is not
+        closed) made of the vertices indices[offsets[i]:offsets[i + 1]].
+
+        Faces may be sorted in named groups, face i belongs to the group
+        groups[face_groups[i]].
+
+        Meshes are immutable, so many objects can share the same one and
+        everything derived from it is computed only once.
+    """
+
+    # number of cells across the mesh of each level of detail, and the least
+    # number of unique edges a mesh needs to have them
+    LEVEL_RESOLUTIONS = (16, 32, 64, 128, 256)
+    LEVEL_MINIMUM_EDGES = 2000
+
+    # least number of faces a mesh needs to have a hierarchy over its faces
+    FACE_HIERARCHY_MINIMUM = 10000
+
+    def __init__(self, vertices, offsets, indices, closed=None,
+                 face_groups=None, groups=None):
+        self.vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.closed = np.ones(len(self), dtype=bool) if closed is None \
+            else np.asarray(closed, dtype=bool)
+        self.face_groups = None if face_groups is None \
+            else np.asarray(face_groups, dtype=np.int64)
+        self.groups = () if groups is None else tuple(map(str, groups))
+        for array in (self.vertices, self.offsets, self.indices, self.closed):
+            array.setflags(write=False)
+        if self.face_groups is not None:
+            self.face_groups.setflags(write=False)
+        self._edges, self._edge_offsets = None, None
+        self._unique_edges, self._unique_edge_ids = None, None
+        self._normals, self._planes = None, None
+        self._levels = None
+        self._face_hierarchy = None
+        self._parts = None
+        self._bounds = None
+        self._centroid, self._vertex_count = None, None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def arrays(self):
+        """
+            Dict with the arrays of the mesh and the ones derived from it
+            that are expensive to compute, see restore.
+        """
+        arrays = {
+            "vertices": self.vertices, "offsets": self.offsets,
+            "indices": self.indices, "closed": self.closed,
+            "centroid": self.centroid,
+            "vertex_count": np.array(self.vertex_count),
+            "unique_edges": self.unique_edges}
+        if self.bounds is not None:
+            arrays["bounds"] = np.array(self.bounds)
+        if self.face_groups is not None:
+            arrays["face_groups"] = self.face_groups
+            arrays["groups"] = np.array(self.groups, dtype=str)
+        return arrays
+
+    @staticmethod
+    def restore(arrays):
+        """ Builds a mesh back from the dict returned by arrays. """
+        mesh = Mesh(
+            arrays["vertices"], arrays["offsets"], arrays["indices"],
+            arrays["closed"], arrays.get("face_groups"),
+            arrays.get("groups"))
+        mesh._centroid = np.array(arrays["centroid"])
+        mesh._vertex_count = int(arrays["vertex_count"])
+        mesh._unique_edges = arrays["unique_edges"]
+        if "bounds" in arrays:
+            mesh._bounds = tuple(np.array(arrays["bounds"]))
+        return mesh
+
+    @staticmethod
+    def from_faces(faces):
+        """
+            Builds a mesh from a list of faces, each a list of points. A face
+            whose last point repeats the first one is a closed polygon.
+        """
+        vertices, offsets, closed = [], [0], []
+        for face in faces:
+            face = list(face)
+            is_closed = len(face) > 1 and face[0] == face[-1]
+            if is_closed:
+                face.pop()
+            vertices.extend(tuple(point) + (0,) * (3 - len(point))
+                            for point in face)
+            offsets.append(len(vertices))
+            closed.append(is_closed)
+        return Mesh(vertices, offsets, np.arange(len(vertices)), closed)
+
+    @property
+    def faces(self):
+        """
+            List of faces, each a list of points. Closed faces repeat their
+            first point at the end.
+        """
+        return self.to_faces(self.vertices)
+
+    def to_faces(self, vertices):
+        """ Same as faces, but taking the points from another buffer. """
+        points = list(map(tuple, vertices[self.indices].tolist()))
+        faces = []
+        for start, end, closed in zip(
+                self.offsets[:-1].tolist(), self.offsets[1:].tolist(),
+                self.closed.tolist()):
+            face = points[start:end]
+            if closed:
+                face.append(face[0])
+            faces.append(face)
+        return faces
+
+    @property
+    def parts(self):
+        """
+            List of (group name, mesh) tuples, with a mesh for every group
+            that has faces, made of only its faces and vertices. A mesh with
+            a single group is its only part.
+        """
+        if self._parts is None:
+            used = [] if self.face_groups is None \
+                else np.unique(self.face_groups)
+            if len(used) < 2:
+                name = self.groups[used[0]] if len(used) else None
+                self._parts = [(name, self)]
+            else:
+                self._parts = [
+                    (self.groups[group], self.select(
+                        np.flatnonzero(self.face_groups == group)))
+                    for group in used.tolist()]
+        return self._parts
+
+    def select(self, faces):
+        """
+            Builds a mesh with only the faces with the given ids, and the
+            vertices they use.
+        """
+        starts = self.offsets[faces]
+        lengths = self.offsets[faces + 1] - starts
+        offsets = np.zeros(len(faces) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        positions = np.repeat(starts - offsets[:-1], lengths) + \
+            np.arange(offsets[-1])
+        used, indices = np.unique(
+            self.indices[positions], return_inverse=True)
+        return Mesh(
+            self.vertices[used], offsets, indices.reshape(-1),
+            self.closed[faces])
+
+    @property
+    def referenced(self):
+        """ Indices of the vertices that are used by some face. """
+        return np.unique(self.indices)
+
+    @property
+    def centroid(self):
+        """ Average of the distinct points used by the faces. """
+        if self._centroid is None:
+            self._build_centroid()
+        return self._centroid
+
+    @property
+    def vertex_count(self):
+        """ Number of distinct points used by the faces. """
+        if self._centroid is None:
+            self._build_centroid()
+        return self._vertex_count
+
+    def _build_centroid(self):
+        points = np.unique(self.vertices[self.referenced], axis=0)
+        # empty meshes, as objects still being loaded, are at the origin
+        centroid = np.mean(points, axis=0) if len(points) else np.zeros(3)
+        # meshes are shared between threads, the attribute that tells if
+        # they were built is set last
+        self._vertex_count, self._centroid = len(points), centroid
+
+    @property
+    def bounds(self):
+        """
+            Minimum and maximum corners of the axis-aligned box around the
+            vertices used by the faces, None if the mesh is empty.
+        """
+        if self._bounds is None and len(self.indices):
+            vertices = self.vertices[self.referenced]
+            self._bounds = (vertices.min(axis=0), vertices.max(axis=0))
+        return self._bounds
+
+    @property
+    def face_hierarchy(self):
+        """
+            Bounding volume hierarchy over the boxes of the faces, in the
+            mesh coordinates. None if the mesh is too small to need one.
+        """
+        if self._face_hierarchy is None and \
+                len(self) >= Mesh.FACE_HIERARCHY_MINIMUM:
+            # empty faces get an empty box at a corner of the mesh
+            minimum = np.tile(self.bounds[0], (len(self), 1))
+            maximum = minimum.copy()
+            filled = np.diff(self.offsets) > 0
+            points = self.vertices[self.indices]
+            starts = self.offsets[:-1][filled]
+            minimum[filled] = np.minimum.reduceat(points, starts)
+            maximum[filled] = np.maximum.reduceat(points, starts)
+            self._face_hierarchy = BoundingVolumeHierarchy(minimum, maximum)
+        return self._face_hierarchy
+
+    def face_edges(self, faces):
+        """ (n, 2) array with the edges of the faces with the given ids. """
+        starts = self.edge_offsets[faces]
+        lengths = self.edge_offsets[faces + 1] - starts
+        first = np.cumsum(lengths) - lengths
+        return self.edges[
+            np.repeat(starts - first, lengths) + np.arange(lengths.sum())]
+
+    @property
+    def edges(self):
+        """
+            (n, 2) array with the vertex indices of the edges of every face,
+            face after face. Closed faces have an edge from their last vertex
+            back to the first one.
+        """
+        if self._edges is None:
+            self._build_edges()
+        return self._edges
+
+    @property
+    def edge_offsets(self):
+        """ Edges of face i are edges[edge_offsets[i]:edge_offsets[i + 1]]. """
+        if self._edges is None:
+            self._build_edges()
+        return self._edge_offsets
+
+    @property
+    def unique_edges(self):
+        """
+            (n, 2) array with every undirected edge of the mesh only once,
+            even if it is shared by many faces.
+        """
+        if self._unique_edges is None:
+            edges = np.sort(self.edges, axis=1).astype(np.int64)
+            edges = edges[edges[:, 0] != edges[:, 1]]
+            keys = np.unique(edges[:, 0] * len(self.vertices) + edges[:, 1])
+            self._unique_edges = np.column_stack(
+                np.divmod(keys, len(self.vertices))).astype(np.int32)
+        return self._unique_edges
+
+    @property
+    def unique_edge_ids(self):
+        """
+            For every edge in edges, the index of the same edge in
+            unique_edges, -1 for edges from a vertex to itself.
+        """
+        if self._unique_edge_ids is None:
+            size = len(self.vertices)
+            keys = self.unique_edges[:, 0].astype(np.int64) * size + \
+                self.unique_edges[:, 1]
+            edges = np.sort(self.edges, axis=1).astype(np.int64)
+            self._unique_edge_ids = np.searchsorted(
+                keys, edges[:, 0] * size + edges[:, 1])
+            self._unique_edge_ids[edges[:, 0] == edges[:, 1]] = -1
+        return self._unique_edge_ids
+
+    def unique_edges_of(self, faces):
+        """ Mask of the unique edges used by the faces in the mask. """
+        ids = self.unique_edge_ids[
+            np.repeat(faces, np.diff(self.edge_offsets))]
+        selected = np.zeros(len(self.unique_edges), dtype=bool)
+        selected[ids[ids >= 0]] = True
+        return selected
+
+    @property
+    def normals(self):
+        """
+            (n, 3) array with the normal of every face, with the length of
+            twice its area (Newell's method). It points to the side from
+            which the face vertices are seen counterclockwise, and is zero
+            for polylines and degenerate faces.
+        """
+        if self._normals is None:
+            self._build_normals()
+        return self._normals
+
+    def front_faces(self, eye):
+        """
+            Mask of the faces that are seen from their front from the eye
+            position, in the mesh coordinates. Faces without a normal are
+            always in the mask.
+        """
+        if self._normals is None:
+            self._build_normals()
+        return (self._normals.dot(eye) > self._planes) | \
+            ~np.any(self._normals, axis=1)
+
+    def _build_normals(self):
+        vertices = self.vertices
+        products = np.cross(
+            vertices[self.edges[:, 0]], vertices[self.edges[:, 1]])
+        normals = np.zeros((len(self), 3))
+        filled = np.flatnonzero(np.diff(self.edge_offsets) > 0)
+        if len(filled):
+            normals[filled] = np.add.reduceat(
+                products, self.edge_offsets[filled])
+        normals[~self.closed] = 0
+        # faces are planes n . p = n . p0, with p0 their first vertex,
+        # empty faces have no normal so their plane doesn't matter
+        planes = np.zeros(len(self))
+        if len(self.indices):
+            first = self.indices[
+                np.minimum(self.offsets[:-1], len(self.indices) - 1)]
+            planes = np.einsum("ij,ij->i", normals, vertices[first])
+        # set last, see _build_centroid
+        self._planes, self._normals = planes, normals
+
+    @property
+    def levels(self):
+        """
+            Simplified versions of the mesh, from the coarsest to the finest,
+            as (resolution, vertices, edges) tuples. Each one is built by
+            merging the vertices that fall in the same cell of a grid with
+            'resolution' cells along the largest side of the mesh.
+        """
+        if self._levels is None:
+            self._levels = []
+            if len(self.unique_edges) >= Mesh.LEVEL_MINIMUM_EDGES:
+                self._levels = [
+                    (resolution, *self._cluster(resolution))
+                    for resolution in Mesh.LEVEL_RESOLUTIONS]
+        return self._levels
+
+    def level_of_detail(self, size):
+        """
+            Returns the vertices and edges of the coarsest level of detail
+            that still has a cell per pixel when the mesh is 'size' pixels
+            wide. Returns None if the full mesh should be used.
+        """
+        for resolution, vertices, edges in self.levels:
+            if resolution >= size:
+                return vertices, edges
+        return None
+
+    def _cluster(self, resolution):
+        minimum, maximum = self.bounds
+        cell = max(np.max(maximum - minimum) / resolution, np.finfo(float).eps)
+        cells = np.clip(
+            ((self.vertices - minimum) / cell).astype(np.int64),
+            0, resolution - 1)
+        keys = (cells[:, 0] * resolution + cells[:, 1]) * resolution + \
+            cells[:, 2]
+
+        # merged vertices are placed at the average of the original ones
+        _, cluster = np.unique(keys, return_inverse=True)
+        cluster = cluster.reshape(-1)
+        count = np.bincount(cluster)
+        vertices = np.column_stack([
+            np.bincount(cluster, self.vertices[:, axis]) / count
+            for axis in range(3)])
+
+        edges = np.sort(cluster[self.unique_edges], axis=1)
+        edges = edges[edges[:, 0] != edges[:, 1]]
+        keys = np.unique(edges[:, 0] * len(vertices) + edges[:, 1])
+        return vertices, np.column_stack(np.divmod(keys, len(vertices)))
+
+    def _build_edges(self):
+        lengths = np.diff(self.offsets)
+        last = self.offsets[1:][lengths > 0] - 1
+        closed = self.closed[lengths > 0]
+
+        following = np.arange(1, len(self.indices) + 1)
+        following[last[closed]] = self.offsets[:-1][lengths > 0][closed]
+        is_edge = np.ones(len(self.indices), dtype=bool)
+        is_edge[last[~closed]] = False
+
+        edges = np.column_stack((
+            self.indices[is_edge], self.indices[following[is_edge]]))
+        edge_offsets = np.zeros(len(self) + 1, dtype=np.int64)
+        np.cumsum(
+            lengths - ((lengths > 0) & ~self.closed), out=edge_offsets[1:])
+        # set last, see _build_centroid
+        self._edge_offsets, self._edges = edge_offsets, edges
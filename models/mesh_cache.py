@@ -0,0 +1,94 @@
+"""
+    This module contains a cache of the meshes parsed from files, stored in
+    binary files that are memory mapped when they are loaded again.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from models.mesh import Mesh
+
+DIRECTORY = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "igs", "meshes")
+MAXIMUM_SIZE = 1 << 30
+FORMAT = 3  # changes when what is stored, or how files are parsed, changes
+
+
+def key(path):
+    """
+        Identifies the current contents of a file by its path, size and
+        modification time.
+    """
+    status = os.stat(path)
+    return (os.path.realpath(path), status.st_size, status.st_mtime_ns)
+
+
+def load(path, directory=DIRECTORY):
+    """
+        Returns the cached mesh of a file, with its arrays memory mapped, or
+        None if the file isn't cached or changed since then.
+    """
+    entry = _entry(path, directory)
+    try:
+        arrays = {
+            name[:-len(".npy")]: np.load(
+                os.path.join(entry, name), mmap_mode="r")
+            for name in os.listdir(entry) if name.endswith(".npy")}
+        mesh = Mesh.restore(arrays)
+        os.utime(entry)  # the entry was used, for the LRU eviction
+    except (OSError, ValueError, KeyError):
+        return None
+    return mesh
+
+
+def store(path, mesh, directory=DIRECTORY, maximum_size=MAXIMUM_SIZE):
+    """
+        Saves the mesh of a file, along with everything derived from it,
+        then evicts the least recently used meshes until the cache fits in
+        'maximum_size' bytes. The cache is only an optimization, failing to
+        write it is silently ignored.
+    """
+    entry, temporary = _entry(path, directory), None
+    try:
+        os.makedirs(directory, exist_ok=True)
+        # written aside and renamed, so no one sees an incomplete entry
+        temporary = tempfile.mkdtemp(dir=directory, prefix=".")
+        for name, array in mesh.arrays.items():
+            np.save(os.path.join(temporary, name + ".npy"), array)
+        shutil.rmtree(entry, ignore_errors=True)
+        os.rename(temporary, entry)
+        _evict(directory, maximum_size, entry)
+    except OSError:
+        if temporary is not None:
+            shutil.rmtree(temporary, ignore_errors=True)
+
+
+def _entry(path, directory):
+    """ Directory of the cached mesh of a file. """
+    digest = hashlib.sha1(repr((FORMAT, key(path))).encode()).hexdigest()
+    return os.path.join(directory, digest)
+
+
+def _evict(directory, maximum_size, keep):
+    """ Removes the least recently used entries that don't fit. """
+    entries = []
+    for name in os.listdir(directory):
+        if name.startswith("."):
+            continue  # still being written
+        entry = os.path.join(directory, name)
+        size = sum(
+            os.path.getsize(os.path.join(entry, file))
+            for file in os.listdir(entry))
+        entries.append((os.path.getmtime(entry), entry, size))
+
+    total = sum(size for _, _, size in entries)
+    for _, entry, size in sorted(entries):
+        if total <= maximum_size:
+            break
+        if entry != keep:
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
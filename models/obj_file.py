@@ -0,0 +1,128 @@
+""" This module contains a streaming parser for Wavefront OBJ files. """
+import re
+
+import numpy as np
+
+CHUNK_SIZE = 1 << 20
+DEFAULT_GROUP = "default"
+
+# everything after the vertex index of a face token, as in 1/2/3 or 1//3
+_TOKEN_SUFFIX = re.compile(r"/\S*")
+
+
+def iter_chunks(path, chunk_size=CHUNK_SIZE):
+    """
+        Reads an OBJ file a chunk at a time and yields, for every chunk, the
+        parsed records as arrays: a (n, 3) float array of vertices, an array
+        with the number of vertices of each face, the flat array of 0-based
+        vertex indices of those faces, whether each face is a closed polygon
+        ('f' records) or a polyline ('l' records), the group of each face and
+        the names of all groups seen so far ('o' and 'g' records).
+    """
+    state = {"vertices": 0, "group": 0, "groups": [DEFAULT_GROUP]}
+    with open(path) as obj:
+        remainder = ""
+        while True:
+            chunk = obj.read(chunk_size)
+            if not chunk:
+                break
+            chunk = remainder + chunk
+            cut = chunk.rfind("\n") + 1
+            remainder = chunk[cut:]
+            yield _parse_lines(chunk[:cut].split("\n"), state)
+        if remainder:
+            yield _parse_lines([remainder], state)
+
+
+def read(path, chunk_size=CHUNK_SIZE):
+    """
+        Parses an OBJ file and returns its vertices, the face offsets, the
+        face indices, which faces are closed, the group of each face and the
+        group names. Face i is made of the vertices
+        indices[offsets[i]:offsets[i + 1]].
+    """
+    return concatenate(list(iter_chunks(path, chunk_size)))
+
+
+def concatenate(chunks):
+    """
+        Joins chunks yielded by iter_chunks into the same arrays returned by
+        read.
+    """
+    if not chunks:
+        return (
+            np.zeros((0, 3)), np.zeros(1, dtype=np.int64),
+            np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool),
+            np.zeros(0, dtype=np.int64), (DEFAULT_GROUP,))
+    vertices, lengths, indices, closed, groups, names = zip(*chunks)
+    offsets = np.zeros(sum(map(len, lengths)) + 1, dtype=np.int64)
+    np.cumsum(np.concatenate(lengths), out=offsets[1:])
+    return (
+        np.concatenate(vertices), offsets, np.concatenate(indices),
+        np.concatenate(closed), np.concatenate(groups), names[-1])
+
+
+def _parse_lines(lines, state):
+    """
+        Parses the records of a list of lines in bulk. State keeps what the
+        following lines need to know: how many vertices and which groups
+        came before them, and the current group.
+    """
+    vertices, faces, before, closed, groups = [], [], [], [], []
+    group = state["group"]
+    for line in lines:
+        if "#" in line:
+            line = line[:line.index("#")]
+        record = line.split(None, 1)
+        if len(record) < 2:
+            if record == ["o"] or record == ["g"]:
+                group = 0  # no name, back to the default group
+            continue
+        keyword, values = record
+        if keyword == "v":
+            vertices.append(values)
+        elif keyword == "f" or keyword == "l":
+            faces.append(values)
+            before.append(len(vertices))
+            closed.append(keyword == "f")
+            groups.append(group)
+        elif keyword == "o" or keyword == "g":
+            name = values.strip()
+            if name not in state["groups"]:
+                state["groups"].append(name)
+            group = state["groups"].index(name)
+    state["group"] = group
+
+    # the values can only be parsed in bulk if every vertex has exactly
+    # three, the total alone can't tell a 2D and a 4D vertex from two 3D
+    counts = np.fromiter(
+        map(len, map(str.split, vertices)), dtype=np.int64,
+        count=len(vertices))
+    if np.all(counts == 3):
+        coordinates = np.fromstring(
+            " ".join(vertices), dtype=np.float64, sep=" ").reshape(-1, 3)
+    else:
+        # some vertices are not 3D (or have a w coordinate), parse them one
+        # by one, keeping only x, y and z, padded with zeros
+        coordinates = np.zeros((len(vertices), 3))
+        for row, vertex in enumerate(vertices):
+            values = vertex.split()[:3]
+            coordinates[row, :len(values)] = list(map(float, values))
+
+    # only the vertex index of each token matters
+    faces = [_TOKEN_SUFFIX.sub("", face) if "/" in face else face
+             for face in faces]
+    lengths = np.fromiter(
+        map(len, map(str.split, faces)), dtype=np.int64, count=len(faces))
+    indices = np.fromstring(" ".join(faces), dtype=np.int64, sep=" ")
+
+    # negative indices count back from the last vertex before the face
+    relative = indices < 0
+    indices -= 1
+    if np.any(relative):
+        before = np.repeat(np.array(before, dtype=np.int64), lengths)
+        indices[relative] += state["vertices"] + before[relative] + 1
+    state["vertices"] += len(vertices)
+    return (
+        coordinates, lengths, indices, np.array(closed, dtype=bool),
+        np.array(groups, dtype=np.int64), tuple(state["groups"]))
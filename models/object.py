@@ -1,6 +1,11 @@
 """ This module contains a class that describes an object in the world. """
+import weakref
+
 import numpy as np
 
+from models import clipping, mesh_cache, obj_file
+from models.mesh import Mesh
+
 
 class Object:
     """
@@ -10,8 +15,16 @@ class Object:
 
     TOTAL_OBJECTS = -1
 
-    def __init__(self, points=None, name=None, color=None):
-        self._points = [] if points is None else points
+    # meshes loaded from files, kept while some object uses them
+    _FILE_MESHES = weakref.WeakValueDictionary()
+
+    def __init__(self, points=None, name=None, color=None, mesh=None):
+        self._mesh = Mesh.from_faces([] if points is None else points) \
+            if mesh is None else mesh
+        self._model_matrix = np.identity(4)
+        self._bounding_box = None
+        self._center = None
+        self._version = 0
         self._name = self.default_name() if name is None else name
         self._color = (0, 0, 0) if color is None else color
         Object.TOTAL_OBJECTS += 1
@@ -24,7 +37,109 @@ class Object:
     @property
     def points(self):
         """ The points in the wireframe. """
-        return self._points
+        return self._mesh.to_faces(self.vertices)
+
+    @property
+    def mesh(self):
+        """ Indexed geometry of the wireframe, in object coordinates. """
+        return self._mesh
+
+    @mesh.setter
+    def mesh(self, mesh):
+        self._set_mesh(mesh)
+
+    @property
+    def version(self):
+        """ Number that changes every time the object is transformed. """
+        return self._version
+
+    @property
+    def model_matrix(self):
+        """
+            Accumulated 4x4 transformation that takes the mesh vertices to
+            world coordinates.
+        """
+        return self._model_matrix
+
+    @property
+    def vertices(self):
+        """ Vertices of the mesh in world coordinates. """
+        return Object.apply_matrix(self._mesh.vertices, self._model_matrix)
+
+    def transformed_vertices(self, matrix):
+        """ Vertices in world coordinates further transformed by matrix. """
+        return Object.apply_matrix(
+            self._mesh.vertices, self._model_matrix.dot(matrix))
+
+    def projected_vertices(self, matrix):
+        """
+            Vertices in world coordinates projected to 2D by a view
+            projection matrix.
+        """
+        return Object.project(
+            self._mesh.vertices, self._model_matrix.dot(matrix))
+
+    @property
+    def bounding_box(self):
+        """
+            Minimum and maximum corners of the axis-aligned box around the
+            object in world coordinates, None if the object is empty.
+        """
+        if self._bounding_box is None and self._mesh.bounds is not None:
+            corners = Object.apply_matrix(
+                Object._box_corners(*self._mesh.bounds), self._model_matrix)
+            self._bounding_box = (corners.min(axis=0), corners.max(axis=0))
+        return self._bounding_box
+
+    def projected_bounds(self, matrix):
+        """
+            2D bounds of the bounding box after being projected by a view
+            projection matrix. Returns None when that can't be known, either
+            because the object is empty or because part of it is behind the
+            center of projection.
+        """
+        if self.bounding_box is None:
+            return None
+        corners = Object.apply_homogeneous_matrix(
+            Object._box_corners(*self.bounding_box), matrix)
+        if np.any(corners[:, 3] <= 0):
+            return None
+        corners = corners[:, :2] / corners[:, 3:]
+        return (corners.min(axis=0), corners.max(axis=0))
+
+    @staticmethod
+    def _box_corners(minimum, maximum):
+        """ The eight corners of a box. """
+        return np.array([
+            [x, y, z]
+            for x in (minimum[0], maximum[0])
+            for y in (minimum[1], maximum[1])
+            for z in (minimum[2], maximum[2])])
+
+    def polylines(self, points, unique_edges=False, faces=None):
+        """
+            The faces of the object as polylines, without clipping, taking
+            its vertices from the projected points. With unique_edges, every
+            edge of the mesh is returned once as a two point polyline. Faces
+            is an optional mask of the faces to draw.
+        """
+        if unique_edges:
+            return clipping.edge_polylines(
+                points, self.unique_edges(faces))
+        return clipping.polylines(points, self._mesh, faces)
+
+    def unique_edges(self, faces=None):
+        """ Unique edges of the mesh, or of the faces in the mask. """
+        if faces is None:
+            return self._mesh.unique_edges
+        return self._mesh.unique_edges[self._mesh.unique_edges_of(faces)]
+
+    def bake(self):
+        """ Applies the model matrix to the mesh vertices and resets it. """
+        self._mesh = Mesh(
+            self.vertices, self._mesh.offsets, self._mesh.indices,
+            self._mesh.closed, self._mesh.face_groups, self._mesh.groups)
+        self._set_model_matrix(np.identity(4))
 
     @property
     def name(self):
@@ -39,46 +154,83 @@ class Object:
     @property
     def center(self):
         """ Center of the object. """
-        points = set()
-        for face in self._points:
-            points.update(face)
-        x_points = [point[0] for point in points]
-        y_points = [point[1] for point in points]
-        z_points = [point[2] for point in points]
-        return \
-            (np.average(x_points), np.average(y_points), np.average(z_points))
-
-    def _transform(self, matrix, center=None, offset=None):
-        center = self.center if center is None else center
+        if self._center is None:
+            self._center = Object.apply_matrix(
+                self._mesh.centroid, self._model_matrix)
+        return tuple(self._center)
 
+    @staticmethod
+    def _operation_matrix(matrix, center, offset=None):
+        """
+            Builds the 4x4 homogeneous matrix that applies the 3x3 'matrix'
+            around 'center' and then moves points by 'offset'.
+        """
         # move object to center
-        operation_matrix = np.array([
-            [1, 0, 0, 0],
-            [0, 1, 0, 0],
-            [0, 0, 1, 0],
-            [-center[0], -center[1], -center[2], 1],
-        ])
+        operation_matrix = np.identity(4)
+        operation_matrix[3, :3] = np.negative(center)
 
         # perform operation
-        operation_matrix = operation_matrix.dot([
-            matrix[0] + [0],
-            matrix[1] + [0],
-            matrix[2] + [0],
-            ([0, 0, 0] if offset is None else offset) + [1],
-        ])
+        operation = np.identity(4)
+        operation[:3, :3] = matrix
+        if offset is not None:
+            operation[3, :3] = offset
+        operation_matrix = operation_matrix.dot(operation)
 
         # move object back to original position
-        operation_matrix = operation_matrix.dot([
-            [1, 0, 0, 0],
-            [0, 1, 0, 0],
-            [0, 0, 1, 0],
-            [center[0], center[1], center[2], 1],
-        ])
-
-        for fpos, face in enumerate(self._points):
-            for ppos, point in enumerate(face):
-                new_point = np.dot(point + (1,), operation_matrix)
-                self._points[fpos][ppos] = tuple(new_point[:3])
+        operation = np.identity(4)
+        operation[3, :3] = center
+        return operation_matrix.dot(operation)
+
+    @staticmethod
+    def apply_matrix(points, matrix):
+        """ Multiplies all (n, 3) points by a 4x4 homogeneous matrix. """
+        return np.dot(points, matrix[:3, :3]) + matrix[3, :3]
+
+    @staticmethod
+    def apply_homogeneous_matrix(points, matrix):
+        """
+            Multiplies all (n, 3) points by a 4x4 matrix that may not be
+            affine, returns the (n, 4) homogeneous coordinates.
+        """
+        return np.dot(points, matrix[:3]) + matrix[3]
+
+    def _transform(self, matrix, center=None, offset=None):
+        center = self.center if center is None else center
+        operation_matrix = Object._operation_matrix(matrix, center, offset)
+
+        # the average of the points moves with them under affine transforms
+        object_center = Object.apply_matrix(
+            np.array(self.center), operation_matrix)
+        self._set_model_matrix(self._model_matrix.dot(operation_matrix))
+        self._center = object_center
+
+    def _set_mesh(self, mesh):
+        """
+            Replaces the geometry of the object, keeping its transform. The
+            model matrix isn't touched, since curves refine their mesh while
+            the frame is rendered in another thread, and a transform made
+            meanwhile would be lost.
+        """
+        self._mesh = mesh
+        self._changed()
+
+    def refine(self, tolerance):
+        """
+            Gives objects with curved geometry the chance to build it again
+            so that it doesn't stray more than the tolerance, in world
+            units, from the real shape.
+        """
+
+    def _set_model_matrix(self, matrix):
+        self._model_matrix = matrix
+        self._changed()
+
+    def _changed(self):
+        """ Forgets what was derived from the mesh and the model matrix. """
+        self._bounding_box = None
+        self._center = None
+        # changed last, so whoever sees the new version sees the new state
+        self._version += 1
 
     def move(self, offset):
         """ Moves the object by an offset = (x, y). """
@@ -121,108 +273,86 @@ class Object:
             Object.generate_rotation_matrix(x_angle, y_angle, z_angle),
             center)
 
-    def project(self):
-        """ Projects the 3D objects to 2D. Using perspective projection. """
-        def _project(point):
-            return (
-                point[0]/(point[2]/Window.COP_DISTANCE+1),
-                point[1]/(point[2]/Window.COP_DISTANCE+1))
-
-        self._points = [list(map(_project, face)) for face in self._points]
-
-    def clip(self, window):
-        """ Weiler-Atherton polygon clipping algorithm. """
-
-        def connect_points(clipped, side1, side2, window):
-            """ Connects points of the window. """
-            edge = side1
-            while edge != side2:
-                clipped.append(window.points[0][edge])
-                edge = (edge - 1) % 4
-
-        boundaries = window.real_boundaries
-        clipped = []
-        for face in self._points:
-            new_face = []
-            entered, exited = None, None
-            for i in range(len(face) - 1):
-                points, side = Object._clip_line(
-                    face[i], face[i + 1], *boundaries[0], *boundaries[1])
-
-                if not points:  # clipped line is outside window
-                    continue
-
-                if side[0] is not None:  # entered
-                    if exited is not None:
-                        connect_points(new_face, exited, side[0], window)
-                    else:
-                        entered = side[0]
-
-                if side[1] is not None:  # exited
-                    exited = side[1]
-                    new_face.append(points[0])
-                    new_face.append(points[1])
-                else:
-                    new_face.append(points[0])
-
-            if new_face and face[0] == face[-1]:
-                if entered is not None:
-                    connect_points(new_face, exited, entered, window)
-                new_face.append(new_face[0])
-
-            clipped.append(new_face)
-
-        self._points = clipped
+    @staticmethod
+    def project(vertices, matrix):
+        """
+            Projects (n, 3) vertices to 2D with a view projection matrix (see
+            Window.view_projection_matrix) and the perspective divide.
+            Returns them as a new (n, 2) array.
+        """
+        vertices = Object.apply_homogeneous_matrix(vertices, matrix)
+        return vertices[:, :2] / vertices[:, 3:]
 
     @staticmethod
-    def _clip_line(point1, point2, xmin, ymin, xmax, ymax):
-        """ Liang-Barsky line clipping algorithm. """
-        deltax, deltay = point2[0] - point1[0], point2[1] - point1[1]
-        deltas = [-deltax, -deltay, deltax, deltay]  # p
-        distances = [  # q
-            point1[0] - xmin, point1[1] - ymin,
-            xmax - point1[0], ymax - point1[1]]
-        ratios = np.divide(distances, deltas)  # r
-        pct1, pct2 = 0, 1  # how much of the line is inside the window
-        side = [None, None]
-        for i in range(4):
-            if deltas[i] == 0 and distances[i] < 0:
-                return (), side
-            if deltas[i] < 0:
-                if ratios[i] > pct1:  # entered
-                    side[0] = i
-                    pct1 = ratios[i]
-            if deltas[i] > 0:
-                if ratios[i] < pct2:  # exited
-                    side[1] = i
-                    pct2 = ratios[i]
-        if pct1 > pct2:
-            return (), side
-        clipped = (
-            tuple(np.add((point1[0], point1[1]), (pct1*deltax, pct1*deltay))),
-            tuple(np.add((point1[0], point1[1]), (pct2*deltax, pct2*deltay))),
-        )
-        return clipped, side
+    def project_instances(vertices, matrices):
+        """
+            Projects the same (n, 3) vertices by k matrices at once, returns
+            a (k, n, 2) array.
+        """
+        points = np.matmul(vertices, matrices[:, :3]) + matrices[:, 3:]
+        return points[:, :, :2] / points[:, :, 3:]
+
+    def clip(self, points, window, unique_edges=False, faces=None):
+        """
+            Clips the faces of the object, taking its vertices from the
+            projected points, and returns them as polylines: an array of
+            points and the offsets delimiting each polyline. With
+            unique_edges, the edges are clipped one by one instead. Faces
+            is an optional mask of the faces that may be visible.
+        """
+        if unique_edges:
+            return clipping.clip_edges(
+                points, self.unique_edges(faces), window.corners)
+        return clipping.clip_faces(
+            points, self._mesh, window.corners, faces)
 
     @staticmethod
     def build_from_file(path):
-        """ Returns objects described in an OBJ file. """
-        with open(path) as obj:
-            raw_file = obj.read()
-        file_lines = [line.split(" ") for line in raw_file.split("\n")]
-
-        vertices = {}
-        faces = []
-        for number, line in enumerate(file_lines):
-            if line[0] == "v":
-                vertices[number + 1] = tuple(map(float, line[1:]))
-            if line[0] == "f":
-                face = []
-                for index in line[1:]:
-                    face.append(vertices[int(index)])
-                face.append(vertices[int(line[1])])
-                faces.append(face)
-        return Object(points=faces)
+        """
+            Returns objects described in an OBJ file. Objects loaded from a
+            file that didn't change share its mesh, which is also kept in
+            the mesh cache, so the file is only parsed once.
+        """
+        mesh = Object.cached_mesh(path)
+        if mesh is None:
+            mesh = Mesh(*obj_file.read(path))
+            Object.cache_mesh(path, mesh)
+        return Object(mesh=mesh)
+
+    def split(self):
+        """
+            Returns an object for every group of faces of the mesh, named
+            after the group, with the same transform and color. Objects with
+            a single group are returned as they are.
+        """
+        parts = self._mesh.parts
+        if len(parts) < 2:
+            return [self]
+        objects = []
+        for group, mesh in parts:
+            obj = Object(
+                name="{}:{}".format(self._name, group), color=self._color,
+                mesh=mesh)
+            obj._set_model_matrix(self._model_matrix.copy())
+            objects.append(obj)
+        return objects
+
+    @staticmethod
+    def cached_mesh(path):
+        """ The mesh of a file, if it was already parsed, else None. """
+        key = mesh_cache.key(path)
+        mesh = Object._FILE_MESHES.get(key)
+        if mesh is None:
+            mesh = mesh_cache.load(path)
+            if mesh is not None:
+                Object._FILE_MESHES[key] = mesh
+        return mesh
+
+    @staticmethod
+    def cache_mesh(path, mesh):
+        """ Keeps the mesh parsed from a file, see cached_mesh. """
+        Object._FILE_MESHES[mesh_cache.key(path)] = mesh
+        mesh_cache.store(path, mesh)
 
 
 class Window(Object):
@@ -249,26 +379,67 @@ class Window(Object):
             [1, 0, 0],
             [0, 1, 0],
             [0, 0, 1]])
+        self._camera = None
 
     @property
     def expanded_boundaries(self):
         """ Boundaries a little bigger than the actual window. """
-        width = self._points[0][3][0] - self._points[0][1][0]
-        height = self._points[0][3][1] - self._points[0][1][1]
-        factor = np.multiply((width, height), Window.BORDER)
-        return (
-            np.subtract(self._points[0][1], factor),
-            np.add(self._points[0][3], factor))
+        minimum, maximum = self.real_boundaries
+        factor = np.multiply(np.subtract(maximum, minimum), Window.BORDER)
+        return (np.subtract(minimum, factor), np.add(maximum, factor))
 
     @property
     def real_boundaries(self):
         """ Returns windows' bottom left and upper right coordinates. """
-        return (self._points[0][1], self._points[0][3])
+        corners = self.corners
+        return (tuple(corners[1]), tuple(corners[3]))
+
+    @property
+    def corners(self):
+        """
+            The window corners as seen from the window itself, that is, after
+            the view transform (see view_matrix).
+        """
+        return self._camera_state()[2]
+
+    @property
+    def view_matrix(self):
+        """
+            Matrix that moves the window center to the origin and rotates the
+            world so the window looks aligned with the axes.
+        """
+        return self._camera_state()[0]
+
+    @property
+    def view_projection_matrix(self):
+        """
+            The view matrix followed by the perspective projection, the
+            vertices it transforms only need to be divided by their fourth
+            coordinate.
+        """
+        return self._camera_state()[1]
+
+    def _camera_state(self):
+        """
+            Builds the view and view projection matrices and the corners,
+            only when the window or the center of projection changed.
+        """
+        key = (self.version, Window.COP_DISTANCE)
+        if self._camera is None or self._camera[0] != key:
+            center = self.center
+            view = Object._operation_matrix(
+                self.inv_rotation_matrix, center, np.negative(center))
+            projection = np.identity(4)
+            projection[2, 3] = 1 / Window.COP_DISTANCE
+            corners = self.transformed_vertices(view)[:, :2]
+            self._camera = (key, (view, view.dot(projection), corners))
+        return self._camera[1]
 
     @property
     def inv_rotation_matrix(self):
         """ This matrix rotates the window back to its original position. """
-        return np.linalg.inv(self._rotation_matrix).tolist()
+        # a rotation matrix is orthonormal, its inverse is its transpose
+        return self._rotation_matrix.T.tolist()
 
     def move(self, offset):
         # rotate offset vector to move window relative to its own directions
@@ -277,7 +448,7 @@ class Window(Object):
 
     def zoom(self, factor):
         # save original state
-        original_points = self._points.copy()
+        original_matrix = self._model_matrix
 
         # apply the zoom operation
         super().zoom(factor**(-1))
@@ -289,7 +460,7 @@ class Window(Object):
 
         # if zoom was exceeded, go back to original state and raise an error
         if width < 10 and height < 10:
-            self._points = original_points
+            self._set_model_matrix(original_matrix)
             raise RuntimeError("Maximum zoom in exceeded")
 
     def rotate(self, x_angle, y_angle, z_angle, center=None):
@@ -299,78 +470,249 @@ class Window(Object):
         matrix = Object.generate_rotation_matrix(x_angle, y_angle, z_angle)
         matrix = np.dot(self.inv_rotation_matrix, matrix)
         matrix = np.dot(matrix, self._rotation_matrix)
-        self._transform(matrix.tolist())
-        # update rotation matrix
+        # update rotation matrix, before the transform changes the version
         self._rotation_matrix = np.dot(self._rotation_matrix, matrix)
+        self._transform(matrix.tolist())
 
-    def clip(self, _):
-        pass
+    def clip(self, points, _, unique_edges=False, faces=None):
+        return self.polylines(points, unique_edges, faces)
 
 
 class Curve(Object):
-    """ A Bezier curve with four control points. """
+    """
+        A Bezier curve with four control points.
 
-    def __init__(self, points, name=None, color=None):
-        curve = Curve._generate_curve(points)
-        curve.append(curve[-1])  # add stub point for clipping
+        Curves are tessellated at a fixed step by default. Adaptive curves
+        are instead split in as many lines as needed for them to be no
+        farther than a tolerance from the real curve, and are tessellated
+        again whenever they are drawn with a different tolerance.
+    """
+
+    BASIS = np.array([
+        [-1, 3, -3, 1],
+        [3, -6, 3, 0],
+        [-3, 3, 0, 0],
+        [1, 0, 0, 0],
+    ])
+    STEPS = 50
+    TOLERANCE = 0.5  # initial tolerance of adaptive curves
+    MAXIMUM_STEPS = 1024
+
+    def __init__(self, points, name=None, color=None, adaptive=False):
+        self._coefficients = type(self)._coefficients_of(
+            np.array(points, dtype=np.float64))
+        self._tolerance = Curve.TOLERANCE if adaptive else None
         super().__init__(
-            points=[curve], name=name, color=color)
+            name=name, color=color, mesh=self._tessellate(self._tolerance))
 
     @staticmethod
-    def _generate_curve(points):
-        def f(t, i):
-            return np.array([t**3, t**2, t, 1]).dot(np.array([
-                [-1, 3, -3, 1],
-                [3, -6, 3, 0],
-                [-3, 3, 0, 0],
-                [1, 0, 0, 0],
-            ])).dot(np.array([p[i] for p in points]))
+    def _coefficients_of(points):
+        """
+            (n, 4, 3) array with the polynomial coefficients, from t**3 to
+            t**0, of every segment of the curve.
+        """
+        return Curve.BASIS.dot(points)[np.newaxis]
+
+    def bake(self):
+        # the coefficients have to follow the vertices, so the curve can
+        # still be tessellated again
+        self._coefficients = np.concatenate((
+            self._coefficients[:, :3].dot(self.model_matrix[:3, :3]),
+            Object.apply_matrix(
+                self._coefficients[:, 3:], self.model_matrix)), axis=1)
+        super().bake()
+
+    def refine(self, tolerance):
+        if self._tolerance is None:
+            return
+        # the mesh is in object coordinates, which the model matrix scales
+        scale = np.cbrt(abs(np.linalg.det(self.model_matrix[:3, :3])))
+        tolerance = tolerance / max(scale, np.finfo(float).eps)
+        if tolerance < self._tolerance or tolerance > 4 * self._tolerance:
+            self._tolerance = tolerance
+            self._set_mesh(self._tessellate(tolerance))
+
+    def _tessellate(self, tolerance=None):
+        """
+            Builds a mesh with a polyline for every segment of the curve,
+            evaluating all segments at all their parameter values at once.
+        """
+        coefficients = self._coefficients
+        if tolerance is None:
+            steps = np.full(len(coefficients), Curve.STEPS)
+        else:
+            # the distance from a curve to the chord between two of its
+            # points is at most an eighth of the largest second derivative
+            # times the squared parameter step
+            second = np.maximum(
+                np.linalg.norm(2 * coefficients[:, 1], axis=1),
+                np.linalg.norm(
+                    6 * coefficients[:, 0] + 2 * coefficients[:, 1], axis=1))
+            steps = np.clip(
+                np.ceil(np.sqrt(second / (8 * tolerance))),
+                1, Curve.MAXIMUM_STEPS).astype(np.int64)
+
+        offsets = np.zeros(len(coefficients) + 1, dtype=np.int64)
+        np.cumsum(steps + 1, out=offsets[1:])
+        segments = np.repeat(np.arange(len(coefficients)), steps + 1)
+        t = (np.arange(offsets[-1]) - offsets[segments]) / steps[segments]
+        a, b, c, d = coefficients[segments].transpose(1, 0, 2)
+        vertices = ((a * t[:, np.newaxis] + b) * t[:, np.newaxis] + c) * \
+            t[:, np.newaxis] + d
+        return Mesh(
+            vertices, offsets, np.arange(len(vertices)),
+            np.zeros(len(coefficients), dtype=bool))
+
+
+class Spline(Curve):
+    """
+        A B-spline curve with arbitrary amount of control points, made of a
+        segment for every four consecutive control points.
+    """
+
+    BASIS = np.multiply(1/6, np.array([
+        [-1, 3, -3, 1],
+        [3, -6, 3, 0],
+        [-3, 0, 3, 0],
+        [1, 4, 1, 0],
+    ]))
+
+    @staticmethod
+    def _coefficients_of(points):
+        if len(points) < 4:
+            return np.zeros((0, 4, 3))
+        windows = np.stack([
+            points[i:len(points) - 3 + i] for i in range(4)], axis=1)
+        return np.einsum("ij,njk->nik", Spline.BASIS, windows)
 
-        step = 0.02
-        x_points = [f(t, 0) for t in np.arange(0, 1+step, step)]
-        y_points = [f(t, 1) for t in np.arange(0, 1+step, step)]
-        z_points = [f(t, 2) for t in np.arange(0, 1+step, step)]
 
-        return list(zip(x_points, y_points, z_points))
+class Surface(Object):
+    """
+        A bicubic Bezier surface, made of patches that share their borders:
+        a grid of 3n + 1 by 3m + 1 control points has n by m patches. It is
+        drawn as a wireframe of lines of constant parameter.
 
+        The tessellation of every patch is kept until its control points
+        change, so changing a control point only tessellates the patches
+        around it again.
+    """
 
-class Spline(Object):
-    """ A Spline curve with arbitrary amount of control points. """
+    BASIS = Curve.BASIS
+    STRIDE = 3  # rows and columns between the first points of two patches
+    STEPS = 16
 
     def __init__(self, points, name=None, color=None):
-        curves = []
-        for i in range(len(points) - 3):
-            # build a curve for every four control points
-            curve = Spline._generate_curve(points[i:i+4])
-            curve.append(curve[-1])  # add stub point for clipping
-            curves.append(curve)
-        super().__init__(
-            points=curves, name=name, color=color)
+        self._control_points = None
+        self._patches = dict()
+        super().__init__(name=name, color=color)
+        self.control_points = points
 
-    @staticmethod
-    def _generate_curve(points):
-        coef = np.multiply(1/6, np.array([
-            [-1, 3, -3, 1],
-            [3, -6, 3, 0],
-            [-3, 0, 3, 0],
-            [1, 4, 1, 0],
-        ])).dot(np.array(points))
-
-        number_of_points = 50
-        delta = 1/number_of_points
-        deltas = np.array([
+    @property
+    def control_points(self):
+        """ (rows, columns, 3) grid of control points. """
+        return self._control_points
+
+    @control_points.setter
+    def control_points(self, points):
+        points = np.array(points, dtype=np.float64)
+        stride = type(self).STRIDE
+        if points.ndim != 3 or points.shape[2] != 3 or \
+                min(points.shape[:2]) < 4 or \
+                any((size - 4) % stride for size in points.shape[:2]):
+            raise RuntimeError(
+                "A surface needs a grid of {} control points".format(
+                    "3n + 1 by 3m + 1" if stride == 3 else "at least 4 by 4"))
+        self._control_points = points
+        self._set_mesh(self._tessellate())
+
+    def bake(self):
+        self._control_points = Object.apply_matrix(
+            self._control_points, self.model_matrix)
+        self._patches = dict()
+        super().bake()
+
+    def _tessellate(self):
+        """
+            Builds a mesh with the lines of every patch, tessellating the
+            patches that aren't known yet all at once.
+        """
+        stride = type(self).STRIDE
+        geometry = np.lib.stride_tricks.sliding_window_view(
+            self._control_points, (4, 4), axis=(0, 1))[::stride, ::stride]
+        geometry = geometry.transpose(0, 1, 3, 4, 2).reshape(-1, 4, 4, 3)
+        keys = [patch.tobytes() for patch in geometry]
+        missing = [key for key in dict.fromkeys(keys)
+                   if key not in self._patches]
+        if missing:
+            grids = type(self)._evaluate(np.stack([
+                geometry[keys.index(key)] for key in missing]))
+            self._patches.update(zip(missing, grids))
+        # patches that are no longer used are forgotten
+        self._patches = {key: self._patches[key] for key in keys}
+        return Surface._wireframe(
+            np.stack([self._patches[key] for key in keys]))
+
+    @classmethod
+    def _evaluate(cls, geometry):
+        """
+            Receives the (n, 4, 4, 3) control points of n patches and returns
+            the (n, steps + 1, steps + 1, 3) grids of points over them,
+            stepping along both parameters with forward differences.
+        """
+        delta = 1 / cls.STEPS
+        differences = np.array([
             [0, 0, 0, 1],
             [delta**3, delta**2, delta, 0],
             [6*delta**3, 2*delta**2, 0, 0],
             [6*delta**3, 0, 0, 0],
-        ]).dot(coef)
+        ]).dot(cls.BASIS)
+        # initial differences of the patches along both parameters
+        differences = np.einsum(
+            "ij,njkc,lk->nilc", differences, geometry, differences)
+        # step along s, every step gives the differences of a curve along t
+        curves = Surface._forward_differences(differences, cls.STEPS, 1)
+        return Surface._forward_differences(curves, cls.STEPS, 2)
+
+    @staticmethod
+    def _forward_differences(differences, steps, axis):
+        """
+            Receives arrays with the value and the first three forward
+            differences of cubic polynomials along an axis, and returns their
+            steps + 1 values along that axis, for all polynomials at once.
+        """
+        differences = np.moveaxis(differences, axis, 0)
+        values = np.repeat(differences[3:], steps + 1, axis=0)
+        for order in (2, 1, 0):
+            values = np.cumsum(
+                np.concatenate((differences[order:order + 1], values[:-1])),
+                axis=0)
+        return np.moveaxis(values, 0, axis)
 
-        points = [tuple(deltas[0])]
-        for _ in range(number_of_points):
-            # update coordinates using forward differences
-            deltas[0] += deltas[1]
-            deltas[1] += deltas[2]
-            deltas[2] += deltas[3]
-            points.append(tuple(deltas[0]))
+    @staticmethod
+    def _wireframe(grids):
+        """
+            Mesh with the rows and the columns of the grids of points as
+            polylines.
+        """
+        patches, rows, columns = grids.shape[:3]
+        grid = np.arange(rows * columns).reshape(rows, columns)
+        indices = (
+            np.arange(patches)[:, np.newaxis] * rows * columns +
+            np.concatenate((grid.reshape(-1), grid.T.reshape(-1))))
+        lengths = np.tile(
+            np.repeat((columns, rows), (rows, columns)), patches)
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return Mesh(
+            grids.reshape(-1, 3), offsets, indices.reshape(-1),
+            np.zeros(len(lengths), dtype=bool))
+
+
+class SplineSurface(Surface):
+    """
+        A bicubic B-spline surface with a patch for every four by four block
+        of control points, which may be any grid of at least four by four.
+    """
 
-        return points
+    BASIS = Spline.BASIS
+    STRIDE = 1
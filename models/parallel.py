@@ -0,0 +1,178 @@
+"""
+    This module contains a renderer that transforms, projects and clips large
+    meshes in a pool of processes.
+"""
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from multiprocessing import shared_memory
+import os
+import threading
+import weakref
+
+import numpy as np
+
+from models import clipping
+from models.mesh import Mesh
+from models.object import Object
+
+
+class ParallelRenderer:
+    """
+        Splits the faces (or unique edges) of large meshes into chunks and
+        clips them in a process pool.
+
+        The mesh arrays are copied once to shared memory, when a mesh is seen
+        for the first time, so every frame only sends the matrices and the
+        chunk boundaries to the workers, never the meshes themselves.
+
+        Workers are started by a fork server, never forked from the
+        application, whose other threads may be holding locks. It may be
+        closed from another thread while it clips, closing then waits for
+        the clipping to end.
+    """
+
+    CHUNK_SIZE = 20000
+    MINIMUM_FACES = 2 * CHUNK_SIZE
+
+    def __init__(self, processes=None):
+        self._processes = os.cpu_count() if processes is None else processes
+        self._pool = ProcessPoolExecutor(
+            self._processes,
+            mp_context=multiprocessing.get_context("forkserver"))
+        self._shared = dict()
+        self._lock = threading.Lock()
+
+    def handles(self, obj, unique_edges=False):
+        """ Whether the object is large enough to be worth splitting. """
+        mesh = obj.mesh
+        size = len(mesh.unique_edges) if unique_edges else len(mesh)
+        return size >= ParallelRenderer.MINIMUM_FACES
+
+    def clip(self, obj, matrix, window, unique_edges=False, faces=None):
+        """
+            Projects the object with a matrix that takes its vertices to the
+            view projection space and clips it against the window. Faces is
+            an optional mask of the faces that may be visible. Returns the
+            same as Object.clip, or None if the renderer was closed.
+        """
+        with self._lock:
+            if self._pool is None:
+                return None
+            return self._clip(obj, matrix, window, unique_edges, faces)
+
+    def _clip(self, obj, matrix, window, unique_edges, faces):
+        arrays = self._share(obj.mesh, unique_edges)
+        if faces is not None and unique_edges:
+            faces = obj.mesh.unique_edges_of(faces)
+        size = len(obj.mesh.unique_edges) if unique_edges else len(obj.mesh)
+        chunk_size = min(
+            ParallelRenderer.CHUNK_SIZE, -(-size // self._processes))
+        futures = [
+            self._pool.submit(
+                _clip_chunk, arrays, (start, min(start + chunk_size, size)),
+                matrix, window.corners, unique_edges,
+                None if faces is None else faces[start:start + chunk_size])
+            for start in range(0, size, chunk_size)]
+        results = [future.result() for future in futures]
+
+        # merge the polylines of all chunks
+        points = np.concatenate([result[0] for result in results])
+        starts = np.cumsum([0] + [len(result[0]) for result in results])
+        offsets = np.concatenate([[0]] + [
+            result[1][1:] + start for result, start in zip(results, starts)])
+        return points, offsets
+
+    def close(self):
+        """ Stops the workers and releases the shared memory. """
+        with self._lock:
+            self._pool.shutdown()
+            self._pool = None
+            for key in list(self._shared):
+                self._release(key)
+
+    def _share(self, mesh, unique_edges):
+        """ Copies the mesh arrays to shared memory, once per mesh. """
+        key = (id(mesh), unique_edges)
+        if key not in self._shared:
+            arrays = [mesh.vertices]
+            arrays += [mesh.unique_edges] if unique_edges else \
+                [mesh.offsets, mesh.indices, mesh.closed]
+            blocks, descriptors = zip(*map(_to_shared_memory, arrays))
+            self._shared[key] = (blocks, descriptors)
+            weakref.finalize(mesh, self._release, key)
+        return self._shared[key][1]
+
+    def _release(self, key):
+        for block in self._shared.pop(key, ((), ()))[0]:
+            block.close()
+            block.unlink()
+
+
+def _to_shared_memory(array):
+    """ Copies an array to a new shared memory block. """
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+    return block, (block.name, array.shape, array.dtype.str)
+
+
+# state kept by each worker process, arrays attached from shared memory and
+# the chunks built from them, which don't change between frames
+_ATTACHED = OrderedDict()
+_CHUNKS = OrderedDict()
+_CACHE_SIZE = 64
+
+
+def _attach(descriptor):
+    name, shape, dtype = descriptor
+    if name not in _ATTACHED:
+        block = shared_memory.SharedMemory(name=name)
+        _ATTACHED[name] = (block, np.ndarray(shape, dtype, buffer=block.buf))
+        if len(_ATTACHED) > _CACHE_SIZE:
+            block, array = _ATTACHED.popitem(last=False)[1]
+            del array  # the block can't be closed while it is in use
+            block.close()
+    return _ATTACHED[name][1]
+
+
+def _chunk(arrays, chunk, unique_edges):
+    """
+        Builds the piece of the mesh made of the faces (or edges) in the
+        chunk, with only the vertices it uses.
+    """
+    key = (arrays[1][0], chunk)
+    if key not in _CHUNKS:
+        vertices = _attach(arrays[0])
+        start, end = chunk
+        if unique_edges:
+            used, edges = np.unique(
+                _attach(arrays[1])[start:end], return_inverse=True)
+            piece = (vertices[used], edges.reshape(-1, 2))
+        else:
+            offsets, indices, closed = map(_attach, arrays[1:])
+            offsets = offsets[start:end + 1]
+            used, indices = np.unique(
+                indices[offsets[0]:offsets[-1]], return_inverse=True)
+            piece = Mesh(
+                vertices[used], offsets - offsets[0], indices,
+                closed[start:end].copy())
+        _CHUNKS[key] = piece
+        if len(_CHUNKS) > _CACHE_SIZE:
+            _CHUNKS.popitem(last=False)
+    return _CHUNKS[key]
+
+
+def _clip_chunk(arrays, chunk, matrix, corners, unique_edges, faces=None):
+    """
+        Projects and clips a chunk of a mesh, only the faces (or edges) in
+        the mask, if given.
+    """
+    piece = _chunk(arrays, chunk, unique_edges)
+    if unique_edges:
+        vertices, edges = piece
+        if faces is not None:
+            edges = edges[faces]
+        return clipping.clip_edges(
+            Object.project(vertices, matrix), edges, corners)
+    return clipping.clip_faces(
+        Object.project(piece.vertices, matrix), piece, corners, faces)
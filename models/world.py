@@ -1,8 +1,10 @@
 """ This module contains the World class. """
-from copy import deepcopy
 import numpy as np
 
-from models.object import Window
+from models import clipping, hidden_lines
+from models.bvh import BoundingVolumeHierarchy
+from models.object import Object, Window
+from models.parallel import ParallelRenderer
 
 
 class World:
@@ -15,8 +17,24 @@ class World:
         window can be moved or scaled like any other object.
     """
 
+    # how far, in pixels, curved objects may be drawn from their real shape
+    TOLERANCE = 0.5
+    # while previewing, simplified meshes have a cell every PREVIEW_REDUCTION
+    # pixels instead of one per pixel
+    PREVIEW_REDUCTION = 8
+
     def __init__(self, window_size):
         self._objects = dict()
+        self._unique_edges = False
+        self._parallel = None
+        self._level_of_detail = False
+        self._backface_culling = False
+        self._hidden_lines = False
+        self._preview = False
+        self._previewing = False
+        self._cache = dict()
+        self._frame_key = None
+        self._hierarchy = None
         self.add_object(Window(*window_size))
 
     def __getitem__(self, name):
@@ -24,40 +42,437 @@ class World:
 
     def viewport_transform(self, viewport_width, viewport_height):
         """
-            Returns a list of lists of coordinates, ready to be drawn in the
-            viewport. Basically this returns all world objects normalized to
-            the viewport coordinates.
+            Returns a list of (points, offsets, color) tuples, ready to be
+            drawn in the viewport. Basically this returns all world objects
+            normalized to the viewport coordinates: points is a (n, 2) array
+            and polyline i is points[offsets[i]:offsets[i + 1]].
         """
-        virtual_world = deepcopy(self._objects)
+        window = self["window"]
+        (x_min, y_min), (x_max, y_max) = window.expanded_boundaries
+        scale = viewport_width / (x_max - x_min)
+
+        # curved objects are tessellated for the current zoom, before the
+        # frame is identified since that may change them
+        for obj in list(self.objects):
+            obj.refine(World.TOLERANCE / scale)
+
+        # the preview may be switched while the frame is rendered, the whole
+        # frame sees the value it had when it began
+        self._previewing = self._preview
+        camera = self._camera_key(
+            viewport_width, viewport_height, self._previewing)
+        self._frame_key = self._build_frame_key(camera)
+
+        # with hidden lines objects hide each other, so all of them are
+        # drawn again when any of them changes
+        if self._hidden_lines:
+            camera = self._frame_key
+
+        def transform_points(points):
+            newx = ((points[:, 0] - x_min)/(x_max - x_min)) * viewport_width
+            newy = (1 - (points[:, 1] - y_min)/(y_max - y_min)) * \
+                viewport_height
+            return np.column_stack((newx, newy))
 
-        # rotate all objects to appear that the window rotated
-        for obj in virtual_world.values():
-            obj._transform(
-                self["window"].inv_rotation_matrix, self["window"].center,
-                np.negative(self["window"].center).tolist())
+        # objects whose boxes can't be seen are skipped, without even
+        # looking at them one by one
+        visible = self._visible_objects(window)
 
-        # clip objects
-        for obj in virtual_world.values():
-            obj.project()
-            obj.clip(virtual_world["window"])
+        # objects are only recomputed if they, or the camera, changed
+        objects = [
+            (name, obj, obj.version)
+            for name, obj in list(self._objects.items())]
+        pending = []
+        for name, obj, version in objects:
+            cached = self._cache.get(name)
+            if cached is None or cached[0] is not obj or \
+                    cached[1:3] != (version, camera):
+                self._cache[name] = (obj, version, camera, None)
+                if obj is window or obj in visible:
+                    pending.append(obj)
 
-        (x_min, y_min), (x_max, y_max) = \
-            virtual_world["window"].expanded_boundaries
+        # the pool may be closed from the main thread, the frame keeps
+        # the renderer it began with
+        parallel = self._parallel
+        projected = self._project_instances(pending, window, parallel)
 
-        def transform_point(point):
-            newx = ((point[0] - x_min)/(x_max - x_min)) * viewport_width
-            newy = (1 - (point[1] - y_min)/(y_max - y_min)) * viewport_height
-            return (newx, newy)
+        # with hidden lines the front faces of all objects are drawn in a
+        # single depth buffer, which the edges of every object are tested
+        # against, except while previewing
+        occlusion = None
+        if self._hidden_lines and not self._previewing:
+            occluders = self._occluders(pending, window)
+            occlusion = (hidden_lines.depth_buffer(
+                occluders.values(), transform_points,
+                (viewport_width, viewport_height)), occluders)
 
-        # build a list of transformed points for each object
+        # build a list of transformed points for each object, every stage
+        # writes new buffers so the objects themselves are left untouched
         output = []
-        for obj in virtual_world.values():
-            new_obj = []
-            for face in obj.points:
-                new_obj.append(list(map(transform_point, face)))
-            output.append((new_obj, obj.color))
+        for name, obj, version in objects:
+            if obj in projected:
+                polylines = self._render_object(
+                    obj, window, transform_points, scale, occlusion,
+                    parallel, projected.get(obj))
+                if polylines is not None:
+                    self._cache[name] = (
+                        obj, version, camera, (*polylines, obj.color))
+            # objects may be removed from the main thread meanwhile
+            cached = self._cache.get(name)
+            if cached is not None and cached[3] is not None:
+                output.append(cached[3])
         return output
 
+    def _project_instances(self, objects, window, parallel):
+        """
+            Projects the vertices of the objects that share a mesh with
+            other objects all at once, except the ones the parallel
+            renderer, if any, handles. Returns a dict with the projected
+            points of every object, None for the ones left to project
+            themselves.
+        """
+        instances = dict()
+        for obj in objects:
+            instances.setdefault(id(obj.mesh), []).append(obj)
+
+        projected = dict.fromkeys(objects)
+        view_projection = window.view_projection_matrix
+        for group in instances.values():
+            mesh = group[0].mesh
+            simplified = self._level_of_detail or self._previewing
+            if len(group) < 2 or (simplified and mesh.levels) or \
+                    (parallel is not None and parallel.handles(
+                        group[0], self._unique_edges)):
+                continue
+            points = Object.project_instances(mesh.vertices, np.stack([
+                obj.model_matrix.dot(view_projection) for obj in group]))
+            projected.update(zip(group, points))
+        return projected
+
+    def _render_object(self, obj, window, transform_points, scale,
+                       occlusion, parallel, points=None):
+        """
+            Projects and clips a single object, returns its polylines in
+            viewport coordinates, or None if it is not visible. Scale is the
+            size of a window unit in pixels, occlusion the depth buffer and
+            the occluders of the frame when drawing hidden lines, and
+            parallel the renderer of large objects, if any. Points are the
+            projected vertices of the object, if they are already known.
+        """
+        view_projection = window.view_projection_matrix
+        boundaries = (*window.corners[1], *window.corners[3])
+
+        # objects completely outside the window are not drawn and the
+        # ones completely inside don't need to be clipped
+        bounds = obj.projected_bounds(view_projection)
+        if bounds is not None and clipping.box_outside(*bounds, *boundaries):
+            return None
+        inside = bounds is not None and clipping.box_inside(
+            *bounds, *boundaries)
+
+        # objects that look small are drawn with a simplified mesh, and so
+        # are all objects while previewing
+        level = None
+        if (self._level_of_detail or self._previewing) and \
+                bounds is not None:
+            size = np.max(bounds[1] - bounds[0]) * scale
+            if self._previewing:
+                size /= World.PREVIEW_REDUCTION
+            level = obj.mesh.level_of_detail(size)
+        if level is not None:
+            vertices, edges = level
+            points = Object.project(
+                vertices, obj.model_matrix.dot(view_projection))
+            if inside:
+                points, offsets = clipping.edge_polylines(points, edges)
+            else:
+                points, offsets = clipping.clip_edges(
+                    points, edges, window.corners)
+            return World._merge_pixels(transform_points(points))
+
+        # edges hidden by the faces of any object are not drawn, if enabled
+        if occlusion is not None and obj in occlusion[1]:
+            buffer, occluders = occlusion
+            mesh, points, depths, faces = occluders[obj]
+            starts, ends = hidden_lines.visible_segments(
+                points, depths, mesh, faces, window.corners,
+                transform_points, buffer)
+            points, offsets = clipping.clip_segments(
+                starts, ends, window.corners)
+            return transform_points(points), offsets
+
+        faces = self._visible_faces(obj, window, inside)
+
+        # large objects are split among processes, if enabled and the
+        # pool wasn't closed meanwhile
+        clipped = None
+        if parallel is not None and \
+                parallel.handles(obj, self._unique_edges):
+            clipped = parallel.clip(
+                obj, obj.model_matrix.dot(view_projection), window,
+                self._unique_edges, faces)
+        if clipped is not None:
+            points, offsets = clipped
+        else:
+            # rotate all objects to appear that the window rotated, and
+            # project them, in a single matrix product
+            if points is None:
+                points = obj.projected_vertices(view_projection)
+
+            # clip objects
+            if inside:
+                points, offsets = obj.polylines(
+                    points, self._unique_edges, faces)
+            else:
+                points, offsets = obj.clip(
+                    points, window, self._unique_edges, faces)
+
+        if self._level_of_detail and self._unique_edges:
+            return World._merge_pixels(transform_points(points))
+        return transform_points(points), offsets
+
+    def _visible_faces(self, obj, window, inside):
+        """
+            Mask of the faces of the object that may be seen, None if all
+            of them may: the ones turned towards the viewer, if the others
+            are left out, that the hierarchy of large meshes finds in the
+            window, unless the object is inside it.
+        """
+        # faces turned away from the viewer are not drawn, if enabled
+        faces = None
+        if (self._backface_culling or self._hidden_lines) and \
+                obj is not window:
+            faces = obj.mesh.front_faces(World._eye(obj, window))
+
+        # large meshes only draw the faces their hierarchy finds in the
+        # window
+        hierarchy = None if inside else obj.mesh.face_hierarchy
+        if hierarchy is not None:
+            found = np.zeros(len(obj.mesh), dtype=bool)
+            found[hierarchy.query(
+                obj.model_matrix.dot(window.view_projection_matrix),
+                *window.corners[1], *window.corners[3])] = True
+            faces = found if faces is None else faces & found
+        return faces
+
+    def _occluders(self, objects, window):
+        """
+            Returns a dict with the (mesh, points, depths, faces) of the
+            objects that can hide others, as hidden_lines.depth_buffer
+            takes them. Objects that cross the plane of the center of
+            projection are left out, and drawn as if nothing hid them.
+        """
+        view_projection = window.view_projection_matrix
+        boundaries = (*window.corners[1], *window.corners[3])
+        occluders = dict()
+        for obj in objects:
+            # objects whose box is in front of the center of projection
+            # have all vertices in front of it
+            bounds = obj.projected_bounds(view_projection)
+            if obj is window or bounds is None or \
+                    clipping.box_outside(*bounds, *boundaries):
+                continue
+            mesh = obj.mesh
+            vertices = Object.apply_homogeneous_matrix(
+                mesh.vertices, obj.model_matrix.dot(view_projection))
+            occluders[obj] = (
+                mesh, vertices[:, :2] / vertices[:, 3:], 1 / vertices[:, 3],
+                self._visible_faces(
+                    obj, window, clipping.box_inside(*bounds, *boundaries)))
+        return occluders
+
+    @staticmethod
+    def _eye(obj, window):
+        """ Position of the center of projection in object coordinates. """
+        matrix = obj.model_matrix.dot(window.view_matrix)
+        return np.dot(
+            (0, 0, -Window.COP_DISTANCE, 1), np.linalg.inv(matrix))[:3]
+
+    def _visible_objects(self, window, region=None):
+        """
+            Returns the set of objects whose bounding boxes may be seen in a
+            region of the window, all of it by default. The window itself
+            is never returned.
+        """
+        if region is None:
+            region = (*window.corners[1], *window.corners[3])
+        objects, hierarchy = self._object_hierarchy()
+        return {
+            objects[item] for item in hierarchy.query(
+                window.view_projection_matrix, *region).tolist()}
+
+    def _object_hierarchy(self):
+        """
+            Bounding volume hierarchy over the world boxes of the objects,
+            rebuilt when an object is added or transformed. Moving the
+            window doesn't change the boxes, so it doesn't rebuild it.
+        """
+        key = [
+            (obj, obj.version) for obj in list(self.objects)
+            if not isinstance(obj, Window)]
+        if self._hierarchy is None or self._hierarchy[0] != key:
+            objects = [obj for obj, _ in key if len(obj.mesh)]
+            boxes = [obj.bounding_box for obj in objects]
+            hierarchy = BoundingVolumeHierarchy(
+                [box[0] for box in boxes], [box[1] for box in boxes])
+            self._hierarchy = (key, objects, hierarchy)
+        return self._hierarchy[1:]
+
+    def pick(self, x, y, viewport_width, viewport_height, tolerance=3):
+        """
+            Returns the name of the object drawn closest to the (x, y)
+            position of the viewport, or None if no object is drawn within
+            'tolerance' pixels from it.
+        """
+        window = self["window"]
+        view_projection = window.view_projection_matrix
+        (x_min, y_min), (x_max, y_max) = window.expanded_boundaries
+        point = np.array([
+            x_min + x / viewport_width * (x_max - x_min),
+            y_min + (1 - y / viewport_height) * (y_max - y_min)])
+        tolerance = tolerance / viewport_width * (x_max - x_min)
+        region = (*(point - tolerance), *(point + tolerance))
+
+        closest, distance = None, tolerance
+        for obj in self._visible_objects(window, region):
+            mesh = obj.mesh
+            hierarchy = mesh.face_hierarchy
+            if hierarchy is None:
+                edges = mesh.unique_edges
+            else:
+                edges = mesh.face_edges(hierarchy.query(
+                    obj.model_matrix.dot(view_projection), *region))
+            if not len(edges):
+                continue
+
+            # distance from the point to every edge of the object
+            starts, ends = Object.project(
+                mesh.vertices[edges.reshape(-1)],
+                obj.model_matrix.dot(view_projection)).reshape(-1, 2, 2) \
+                .transpose(1, 0, 2)
+            deltas = ends - starts
+            lengths = np.einsum("ij,ij->i", deltas, deltas)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                ratios = np.einsum("ij,ij->i", point - starts, deltas) / \
+                    lengths
+            ratios = np.clip(np.nan_to_num(ratios), 0, 1)
+            nearest = starts + ratios[:, np.newaxis] * deltas
+            edge_distance = np.nanmin(np.hypot(*(nearest - point).T))
+            if edge_distance <= distance:
+                closest, distance = obj.name, edge_distance
+        return closest
+
+    @staticmethod
+    def _merge_pixels(points):
+        """
+            Receives segments in viewport coordinates, as returned by
+            clipping.clip_edges, and drops the ones that collapse to a single
+            pixel or to the same pixels of another segment.
+        """
+        pixels = np.floor(points).astype(np.int64).reshape(-1, 2, 2)
+        keys = np.sort(pixels[:, :, 0] * (1 << 20) + pixels[:, :, 1], axis=1)
+        keep = np.flatnonzero(keys[:, 0] != keys[:, 1])
+        _, first = np.unique(keys[keep], axis=0, return_index=True)
+        keep = keep[np.sort(first)]
+        points = points.reshape(-1, 2, 2)[keep].reshape(-1, 2)
+        return points, np.arange(0, len(points) + 1, 2)
+
+    def is_dirty(self, viewport_width, viewport_height):
+        """
+            Whether viewport_transform would return something different from
+            the last time it was called, because an object was added or
+            transformed, or the window changed.
+        """
+        return self._frame_key != self._build_frame_key(
+            self._camera_key(viewport_width, viewport_height, self._preview))
+
+    def _camera_key(self, viewport_width, viewport_height, preview):
+        """ Everything that, if changed, changes how all objects look. """
+        return (
+            self["window"].version, Window.COP_DISTANCE, self._unique_edges,
+            self._level_of_detail, self._backface_culling,
+            self._hidden_lines, preview, viewport_width, viewport_height)
+
+    def _build_frame_key(self, camera):
+        return (camera, [(obj, obj.version) for obj in list(self.objects)])
+
+    @property
+    def unique_edges(self):
+        """
+            Whether objects are drawn as the list of their unique edges,
+            instead of face by face, so edges shared by faces are clipped and
+            drawn only once.
+        """
+        return self._unique_edges
+
+    @unique_edges.setter
+    def unique_edges(self, value):
+        self._unique_edges = value
+
+    @property
+    def level_of_detail(self):
+        """
+            Whether objects that look small in the viewport are drawn with a
+            simplified set of edges, see Mesh.level_of_detail.
+        """
+        return self._level_of_detail
+
+    @level_of_detail.setter
+    def level_of_detail(self, value):
+        self._level_of_detail = value
+
+    @property
+    def backface_culling(self):
+        """
+            Whether the faces of closed objects that are turned away from
+            the viewer are left out.
+        """
+        return self._backface_culling
+
+    @backface_culling.setter
+    def backface_culling(self, value):
+        self._backface_culling = value
+
+    @property
+    def hidden_lines(self):
+        """
+            Whether the edges hidden behind faces of the same object are
+            left out, which also leaves out the faces turned away.
+        """
+        return self._hidden_lines
+
+    @hidden_lines.setter
+    def hidden_lines(self, value):
+        self._hidden_lines = value
+
+    @property
+    def preview(self):
+        """
+            Whether large objects are drawn with a coarse simplified mesh,
+            which is much faster to draw, while the view is being changed.
+        """
+        return self._preview
+
+    @preview.setter
+    def preview(self, value):
+        self._preview = value
+
+    @property
+    def parallel(self):
+        """
+            Whether large objects are transformed and clipped in a pool of
+            processes.
+        """
+        return self._parallel is not None
+
+    @parallel.setter
+    def parallel(self, value):
+        if value and self._parallel is None:
+            self._parallel = ParallelRenderer()
+        elif not value and self._parallel is not None:
+            parallel, self._parallel = self._parallel, None
+            parallel.close()
+
     @property
     def objects(self):
         """ Returns the set of objects. """
@@ -66,3 +481,8 @@ class World:
     def add_object(self, obj):
         """ Adds a new object. """
         self._objects[obj.name] = obj
+
+    def remove_object(self, name):
+        """ Removes an object. """
+        self._objects.pop(name)
+        self._cache.pop(name, None)
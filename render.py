@@ -0,0 +1,189 @@
+"""
+    Renders OBJ files to PNG or SVG images without a display.
+
+    Every file becomes an image, or all of them a single one with --scene,
+    and --frames turns each image into a turntable animation. Images are
+    rendered in a pool of processes.
+
+    The camera is a list of operations applied to the window, one per line
+    or separated by semicolons, with angles in degrees:
+
+        zoom 1.5; move 0 50 0; rotate 30 0 0
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import numpy as np
+
+from models.object import Object, Window
+from models.world import World
+from windows.drawing import draw_frame
+
+FORMATS = ("png", "svg")
+
+
+def parse_camera(text):
+    """ Parses a camera description into a list of (operation, values). """
+    camera = []
+    for command in text.replace("\n", ";").split(";"):
+        if not command.strip():
+            continue
+        operation, *values = command.split()
+        arity = {"zoom": 1, "move": 3, "rotate": 3}.get(operation)
+        try:
+            if arity is None or len(values) != arity:
+                raise ValueError
+            camera.append((operation, tuple(map(float, values))))
+        except ValueError:
+            raise ValueError(
+                "Invalid camera operation: {}".format(command)) from None
+    return camera
+
+
+def build_world(paths, size, camera, fit, frame=0, frames=1):
+    """
+        Builds a world with the objects of the files, seen through a window
+        that was fitted to them, if asked to, and then moved by the camera
+        operations. The objects are rotated around their center to the
+        given frame of a turntable of 'frames' frames.
+    """
+    world = World(size)
+    objects = []
+    for path in paths:
+        obj = Object.build_from_file(path)
+        objects.append(obj)
+        world.add_object(obj)
+
+    boxes = [obj.bounding_box for obj in objects if obj.bounding_box]
+    window = world["window"]
+    if boxes:
+        minimum = np.min([box[0] for box in boxes], axis=0)
+        maximum = np.max([box[1] for box in boxes], axis=0)
+        center = (minimum + maximum) / 2
+        if frame:
+            for obj in objects:
+                obj.rotate(0, 2 * np.pi * frame / frames, 0, center)
+        if fit:
+            window.move((center[0], center[1], 0))
+            extent = np.max(maximum[:2] - minimum[:2])
+            try:
+                window.zoom(min(size) / max(extent, np.finfo(float).eps))
+            except RuntimeError:
+                pass  # too small, it is shown as close as possible
+
+    for operation, values in camera:
+        if operation == "rotate":
+            values = np.radians(values)
+        getattr(window, operation)(*values)
+    return world
+
+
+def render(job):
+    """ Renders a single image, returns its path. """
+    paths, output, size, camera, options = job
+    # cairo is only needed to write the images, not to build the jobs
+    import cairo
+
+    Window.COP_DISTANCE = options["perspective"]
+    world = build_world(
+        paths, size, camera, options["fit"], options["frame"],
+        options["frames"])
+    frame = world.viewport_transform(*size)
+
+    if output.endswith(".svg"):
+        surface = cairo.SVGSurface(output, *size)
+    else:
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, *size)
+    ctx = cairo.Context(surface)
+    ctx.set_source_rgb(1, 1, 1)
+    ctx.paint()
+    draw_frame(ctx, frame)
+    if output.endswith(".svg"):
+        surface.finish()
+    else:
+        surface.write_to_png(output)
+    return output
+
+
+def build_jobs(args):
+    """ One job for every image that has to be rendered. """
+    try:
+        width, height = map(int, args.size.split("x"))
+    except ValueError:
+        raise ValueError("Invalid size: {}".format(args.size)) from None
+    if args.frames < 1:
+        raise ValueError("Invalid number of frames: {}".format(args.frames))
+    if args.processes is not None and args.processes < 1:
+        raise ValueError(
+            "Invalid number of processes: {}".format(args.processes))
+    camera = parse_camera(args.camera)
+    if args.camera_file is not None:
+        with open(args.camera_file) as camera_file:
+            camera += parse_camera(camera_file.read())
+
+    scenes = [("scene", args.files)] if args.scene else [
+        (os.path.splitext(os.path.basename(path))[0], [path])
+        for path in args.files]
+    jobs = []
+    for name, paths in scenes:
+        for frame in range(args.frames):
+            if args.frames > 1:
+                name_of_frame = "{}_{:04d}".format(name, frame)
+            else:
+                name_of_frame = name
+            output = os.path.join(
+                args.output, "{}.{}".format(name_of_frame, args.format))
+            jobs.append((paths, output, (width, height), camera, {
+                "perspective": args.perspective, "fit": args.fit,
+                "frame": frame, "frames": args.frames}))
+    return jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="OBJ files to render")
+    parser.add_argument(
+        "-o", "--output", default=".", help="directory of the images")
+    parser.add_argument("-f", "--format", choices=FORMATS, default="png")
+    parser.add_argument(
+        "-s", "--size", default="500x500", help="image size, as WxH")
+    parser.add_argument(
+        "-c", "--camera", default="", help="camera operations")
+    parser.add_argument(
+        "--camera-file", help="file with more camera operations")
+    parser.add_argument(
+        "--fit", action="store_true",
+        help="fit the window to the objects before the camera operations")
+    parser.add_argument(
+        "--perspective", type=float, default=300,
+        help="distance to the center of projection")
+    parser.add_argument(
+        "--scene", action="store_true",
+        help="render all files together instead of one image per file")
+    parser.add_argument(
+        "--frames", type=int, default=1,
+        help="frames of a turntable animation around the vertical axis")
+    parser.add_argument(
+        "-j", "--processes", type=int, default=None,
+        help="number of processes, all processors by default")
+    args = parser.parse_args()
+
+    try:
+        jobs = build_jobs(args)
+    except (ValueError, OSError) as error:
+        parser.error(str(error))
+    os.makedirs(args.output, exist_ok=True)
+    if args.processes == 1:
+        for output in map(render, jobs):
+            print(output)
+    else:
+        with ProcessPoolExecutor(args.processes) as pool:
+            for output in pool.map(render, jobs):
+                print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+""" This module draws the frames built by the world with cairo. """
+import numpy as np
+
+
+def draw_frame(ctx, frame):
+    """
+        Strokes the polylines of a frame returned by
+        World.viewport_transform. All polylines with the same color are
+        added to a single path, so there is only one stroke per color.
+    """
+    ctx.set_line_width(1)
+    by_color = {}
+    for points, offsets, color in frame:
+        by_color.setdefault(tuple(color), []).append((points, offsets))
+
+    for color, polylines in by_color.items():
+        ctx.set_source_rgb(*color)
+        for points, offsets in polylines:
+            _append_path(ctx, points, offsets)
+        ctx.stroke()
+
+
+def _append_path(ctx, points, offsets):
+    """ Adds the polylines to the current path of the context. """
+    starts = np.zeros(len(points), dtype=bool)
+    starts[offsets[:-1][np.diff(offsets) > 0]] = True
+    move_to, line_to = ctx.move_to, ctx.line_to
+    for (x, y), start in zip(points.tolist(), starts.tolist()):
+        if start:
+            move_to(x, y)
+        else:
+            line_to(x, y)
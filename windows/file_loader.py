@@ -0,0 +1,90 @@
+""" This module contains a loader that reads OBJ files in background. """
+import threading
+import time
+import traceback
+
+from gi.repository import GLib
+import numpy as np
+
+from models import obj_file
+from models.mesh import Mesh
+from models.object import Object
+
+
+class FileLoader:
+    """
+        Parses an OBJ file on a background thread, a chunk at a time, and
+        gives the object the part of the mesh read so far, at most once
+        every REFRESH_INTERVAL seconds, so it can be drawn before the whole
+        file is read. The object is changed in the main loop, which then
+        calls 'on_update'. Once the file is read, 'on_loaded' is called
+        with the object, if given. If it can't be read, 'on_failed' is
+        called with the object and the error instead, if given.
+    """
+
+    REFRESH_INTERVAL = 0.5
+
+    def __init__(self, path, obj, on_update, on_loaded=None,
+                 on_failed=None):
+        self._path = path
+        self._obj = obj
+        self._on_update = on_update
+        self._on_loaded = on_loaded
+        self._on_failed = on_failed
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+
+    def _run(self):
+        try:
+            mesh = Object.cached_mesh(self._path)
+            if mesh is None:
+                mesh = self._parse()
+                Object.cache_mesh(self._path, mesh)
+        except Exception as error:
+            traceback.print_exc()
+            GLib.idle_add(self._fail, error)
+            return
+        GLib.idle_add(self._deliver, mesh, True)
+
+    def _parse(self):
+        """ Parses the file, sending partial meshes along the way. """
+        chunks = []
+        refreshed = time.monotonic()
+        for chunk in obj_file.iter_chunks(self._path):
+            chunks.append(chunk)
+            if time.monotonic() - refreshed >= FileLoader.REFRESH_INTERVAL:
+                GLib.idle_add(self._deliver, FileLoader._partial_mesh(
+                    *obj_file.concatenate(chunks)))
+                refreshed = time.monotonic()
+        return Mesh(*obj_file.concatenate(chunks))
+
+    @staticmethod
+    def _partial_mesh(vertices, offsets, indices, closed, face_groups,
+                      groups):
+        """
+            Mesh without the faces that use vertices that weren't read yet.
+        """
+        lengths = np.diff(offsets)
+        filled = np.flatnonzero(lengths > 0)
+        complete = np.ones(len(lengths), dtype=bool)
+        if len(filled):
+            complete[filled] = np.maximum.reduceat(
+                indices, offsets[filled]) < len(vertices)
+        keep = np.repeat(complete, lengths)
+        offsets = np.zeros(len(offsets), dtype=np.int64)
+        np.cumsum(np.where(complete, lengths, 0), out=offsets[1:])
+        return Mesh(
+            vertices, offsets[np.append(True, complete)], indices[keep],
+            closed[complete], face_groups[complete], groups)
+
+    def _deliver(self, mesh, loaded=False):
+        self._obj.mesh = mesh
+        self._on_update()
+        if loaded and self._on_loaded is not None:
+            self._on_loaded(self._obj)
+        return False  # run only once
+
+    def _fail(self, error):
+        if self._on_failed is not None:
+            self._on_failed(self._obj, error)
+        return False  # run only once
@@ -1,18 +1,26 @@
 """ This module contains the main window of the application. """
 from enum import Enum
+import time
 
-from gi.repository import Gtk
+from gi.repository import GLib, Gtk
 import numpy as np
 
-from models.object import Curve, Object, Spline, Window
+from models.object import (
+    Curve, Object, Spline, SplineSurface, Surface, Window)
 from models.world import World
 from .dialog import EntryDialog
+from .file_loader import FileLoader
+from .render_worker import RenderWorker
 
 
 class MainWindow:
     """ Main window that contains the viewport to the world. """
 
     VIEWPORT_SIZE = (500, 500)
+    # inputs less than PREVIEW_INTERVAL seconds apart are drawn with a
+    # preview, until there is no input for IDLE_TIMEOUT milliseconds
+    PREVIEW_INTERVAL = 0.25
+    IDLE_TIMEOUT = 300
 
     class _Rotation(Enum):
         OBJECT = 0
@@ -28,7 +36,18 @@ class MainWindow:
             """ Decorates methods that need to redraw to take effect. """
             def wrapper(self, *args, **kwargs):
                 func(self, *args, **kwargs)
-                self._builder.get_object("viewport").queue_draw()
+                self._render_worker.request()
+            return wrapper
+
+        @staticmethod
+        def navigates(func):
+            """
+                Decorates methods that change the view, which are drawn with
+                a preview while they come in quick succession.
+            """
+            def wrapper(self, *args, **kwargs):
+                self._on_navigation()
+                func(self, *args, **kwargs)
             return wrapper
 
     def __init__(self):
@@ -38,6 +57,7 @@ class MainWindow:
         handlers = {
             "on_destroy": Gtk.main_quit,
             "on_draw": self._on_draw,
+            "on_viewport_clicked": self._on_viewport_clicked,
             "on_button_up_clicked": lambda _: self._move_object(0, 1, 0),
             "on_button_down_clicked": lambda _: self._move_object(0, -1, 0),
             "on_button_left_clicked": lambda _: self._move_object(-1, 0, 0),
@@ -56,7 +76,15 @@ class MainWindow:
             "on_create_wireframe": self._create_wireframe,
             "on_create_curve": self._create_curve,
             "on_create_spline": self._create_spline,
+            "on_create_surface": lambda _: self._create_surface(Surface),
+            "on_create_spline_surface":
+                lambda _: self._create_surface(SplineSurface),
             "update_perspective": self._update_perspective,
+            "on_unique_edges_toggled": self._toggle_unique_edges,
+            "on_parallel_toggled": self._toggle_parallel,
+            "on_level_of_detail_toggled": self._toggle_level_of_detail,
+            "on_backface_culling_toggled": self._toggle_backface_culling,
+            "on_hidden_lines_toggled": self._toggle_hidden_lines,
         }
         self._builder.connect_signals(handlers)
         self._builder.get_object("viewport").set_size_request(
@@ -65,6 +93,16 @@ class MainWindow:
         # create world
         self._world = World(MainWindow.VIEWPORT_SIZE)
 
+        # frames are rendered in background, the last one is kept to be
+        # drawn again while the world doesn't change
+        self._frame = None
+        self._render_worker = RenderWorker(
+            self._world, MainWindow.VIEWPORT_SIZE, self._show_frame)
+
+        # when the last input came, and the timeout that ends the preview
+        self._last_input = None
+        self._idle_timeout = None
+
         # create tree view that shows object names
         self._store = Gtk.ListStore(str)
         self._builder.get_object("object_tree").set_model(self._store)
@@ -86,18 +124,49 @@ class MainWindow:
         Window.COP_DISTANCE = \
             self._builder.get_object("perspective_scale").get_value()
         self._builder.get_object("main_window").show_all()
+        self._render_worker.request()
 
     def _on_draw(self, _, ctx):
-        ctx.set_line_width(1)
-        for obj, color in \
-                self._world.viewport_transform(*MainWindow.VIEWPORT_SIZE):
-            ctx.set_source_rgb(*color)
-            for face in obj:
-                if face:
-                    ctx.move_to(*face[0])
-                    for point in face[1:]:
-                        ctx.line_to(*point)
-                    ctx.stroke()
+        if self._frame is not None:
+            ctx.set_source_surface(self._frame, 0, 0)
+            ctx.paint()
+
+    def _show_frame(self, frame):
+        """ Receives a frame rendered by the render worker. """
+        self._frame = frame
+        self._builder.get_object("viewport").queue_draw()
+
+    def _on_viewport_clicked(self, _, event):
+        """ Selects the object drawn under the mouse pointer. """
+        name = self._world.pick(event.x, event.y, *MainWindow.VIEWPORT_SIZE)
+        if name is None:
+            return
+        for row in self._store:
+            if row[0] == name:
+                self._builder.get_object("object_tree").get_selection() \
+                    .select_iter(row.iter)
+                break
+
+    def _on_navigation(self):
+        """ Switches to the preview while inputs come quickly. """
+        now = time.monotonic()
+        if self._last_input is not None and \
+                now - self._last_input < MainWindow.PREVIEW_INTERVAL:
+            self._world.preview = True
+        self._last_input = now
+
+        if self._idle_timeout is not None:
+            GLib.source_remove(self._idle_timeout)
+        self._idle_timeout = GLib.timeout_add(
+            MainWindow.IDLE_TIMEOUT, self._on_idle)
+
+    def _on_idle(self):
+        """ Draws the full frame once the inputs stop. """
+        self._idle_timeout = None
+        if self._world.preview:
+            self._world.preview = False
+            self._render_worker.request()
+        return False  # run only once
 
     def _get_selected(self):
         tree, pos = self._builder.get_object("object_tree") \
@@ -105,6 +174,7 @@ class MainWindow:
         return "window" if pos is None else tree[pos][0]
 
     @_Decorators.needs_redraw
+    @_Decorators.navigates
     def _move_object(self, x_offset, y_offset, z_offset):
         """ Moves a selected object. """
         step = int(self._builder.get_object("move_step_entry").get_text())
@@ -112,6 +182,7 @@ class MainWindow:
         self._world[self._get_selected()].move(offset)
 
     @_Decorators.needs_redraw
+    @_Decorators.navigates
     def _zoom_object(self, zoom_in):
         """ Zoom in or out the selected object. """
         step = int(self._builder.get_object("move_step_entry").get_text())
@@ -127,6 +198,7 @@ class MainWindow:
             dialog.destroy()
 
     @_Decorators.needs_redraw
+    @_Decorators.navigates
     def _rotate_object(self, right):
         """ Rotates the selected object left or right. """
         angle = np.radians(
@@ -161,12 +233,46 @@ class MainWindow:
             ))
 
         if dialog.run() == Gtk.ResponseType.OK:
-            obj = Object.build_from_file(dialog.get_filename())
+            # the object is shown right away and filled while it is read
+            obj = Object()
             self._world.add_object(obj)
             self._store.append([obj.name])
+            FileLoader(
+                dialog.get_filename(), obj, self._render_worker.request,
+                self._split_object, self._on_load_failed)
 
         dialog.destroy()
 
+    @_Decorators.needs_redraw
+    def _on_load_failed(self, obj, error):
+        """ Removes an object whose file couldn't be read and says why. """
+        self._remove_object(obj)
+        dialog = Gtk.MessageDialog(
+            self._builder.get_object("main_window"),
+            Gtk.DialogFlags.MODAL, Gtk.MessageType.ERROR,
+            Gtk.ButtonsType.OK, "Couldn't open the file: {}".format(error))
+        dialog.run()
+        dialog.destroy()
+
+    def _remove_object(self, obj):
+        """ Removes an object from the world and from the tree view. """
+        self._world.remove_object(obj.name)
+        for row in self._store:
+            if row[0] == obj.name:
+                self._store.remove(row.iter)
+                break
+
+    @_Decorators.needs_redraw
+    def _split_object(self, obj):
+        """ Replaces an object by one object per group of its faces. """
+        parts = obj.split()
+        if len(parts) < 2:
+            return
+        self._remove_object(obj)
+        for part in parts:
+            self._world.add_object(part)
+            self._store.append([part.name])
+
     @_Decorators.needs_redraw
     def _create_wireframe(self, _):
         """
@@ -175,12 +281,12 @@ class MainWindow:
         """
         dialog = EntryDialog(
             self._builder.get_object("main_window"), "Enter the coordinates",
-            Object.default_name(), "0,0;50,0;50,50")
+            Object.default_name(), "0,0,0;50,0,0;50,50,0")
         if dialog.run():
             points = dialog.points
             points.append(points[0])
             self._world.add_object(
-                Object(points, dialog.name, dialog.color))
+                Object([points], dialog.name, dialog.color))
             self._store.append([dialog.name])
         dialog.destroy()
 
@@ -192,7 +298,9 @@ class MainWindow:
             Object.default_name(), "-100,0,0;300,200,0;-100,300,0;100,0,0")
         if dialog.run():
             self._world.add_object(
-                Curve(dialog.points[:4], dialog.name, dialog.color))
+                Curve(
+                    dialog.points[:4], dialog.name, dialog.color,
+                    adaptive=True))
             self._store.append([dialog.name])
         dialog.destroy()
 
@@ -212,10 +320,62 @@ class MainWindow:
             "900,0,0")
         if dialog.run():
             self._world.add_object(
-                Spline(dialog.points, dialog.name, dialog.color))
+                Spline(
+                    dialog.points, dialog.name, dialog.color,
+                    adaptive=True))
             self._store.append([dialog.name])
         dialog.destroy()
 
+    @_Decorators.needs_redraw
+    def _create_surface(self, surface_class):
+        """
+            Prompts the user for the control points of a surface, given row
+            after row, four points per row.
+        """
+        dialog = EntryDialog(
+            self._builder.get_object("main_window"), "Enter the points",
+            Object.default_name(), ";".join(
+                "{},{},{}".format(x, (x * y) // 100, y)
+                for y in (-150, -50, 50, 150) for x in (-150, -50, 50, 150)))
+        while dialog.run():
+            points = dialog.points
+            try:
+                if len(points) % 4:
+                    raise RuntimeError("Enter four points per row")
+                self._world.add_object(surface_class(
+                    [points[row:row + 4] for row in range(0, len(points), 4)],
+                    dialog.name, dialog.color))
+            except RuntimeError as error:
+                message = Gtk.MessageDialog(
+                    dialog, Gtk.DialogFlags.MODAL, Gtk.MessageType.WARNING,
+                    Gtk.ButtonsType.OK, str(error))
+                message.run()
+                message.destroy()
+                continue
+            self._store.append([dialog.name])
+            break
+        dialog.destroy()
+
     @_Decorators.needs_redraw
     def _update_perspective(self, scale):
         Window.COP_DISTANCE = scale.get_value()
+
+    @_Decorators.needs_redraw
+    def _toggle_unique_edges(self, button):
+        self._world.unique_edges = button.get_active()
+
+    @_Decorators.needs_redraw
+    def _toggle_parallel(self, button):
+        self._world.parallel = button.get_active()
+
+    @_Decorators.needs_redraw
+    def _toggle_level_of_detail(self, button):
+        self._world.level_of_detail = button.get_active()
+
+    @_Decorators.needs_redraw
+    def _toggle_backface_culling(self, button):
+        self._world.backface_culling = button.get_active()
+
+    @_Decorators.needs_redraw
+    def _toggle_hidden_lines(self, button):
+        self._world.hidden_lines = button.get_active()
@@ -0,0 +1,61 @@
+""" This module contains a worker that renders the world in background. """
+import threading
+import traceback
+
+import cairo
+from gi.repository import GLib
+
+from .drawing import draw_frame
+
+
+class RenderWorker:
+    """
+        Renders frames of the world on a background thread, so the GTK main
+        loop never waits for viewport_transform.
+
+        Redraw requests made while a frame is being rendered are merged into
+        a single new frame, the intermediate states are never rendered.
+        Finished frames are handed to 'on_frame' in the main loop.
+    """
+
+    def __init__(self, world, size, on_frame):
+        self._world = world
+        self._size = size
+        self._on_frame = on_frame
+        self._pending = False
+        self._condition = threading.Condition()
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+
+    def request(self):
+        """ Asks for a new frame. """
+        with self._condition:
+            self._pending = True
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                self._pending = False
+
+            if not self._world.is_dirty(*self._size):
+                continue
+            try:
+                frame = self._render()
+            except Exception:
+                traceback.print_exc()  # keep the worker alive
+                continue
+            GLib.idle_add(self._deliver, frame)
+
+    def _render(self):
+        """ Renders the world into a new offscreen surface. """
+        frame = cairo.ImageSurface(cairo.FORMAT_ARGB32, *self._size)
+        draw_frame(cairo.Context(frame), self._world.viewport_transform(
+            *self._size))
+        return frame
+
+    def _deliver(self, frame):
+        self._on_frame(frame)
+        return False  # run only once